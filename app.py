@@ -3,33 +3,113 @@ Homie - Family Utility App (Refactored)
 Main application module using modular architecture
 """
 import os
+import secrets
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from jinja2 import FileSystemBytecodeCache
 
 # Import our custom modules
-from config import get_app_config, get_oidc_configuration, load_access_control, setup_logging, load_local_users, get_currency_symbol
-from database import init_db, get_dashboard_stats, get_recent_activities
+from config import get_app_config, get_oidc_configuration, load_access_control, setup_logging, load_local_users, get_local_user
+from database import (
+    init_db, release_db_connection, get_dashboard_payload, mark_data_changed,
+    create_or_update_user, create_or_update_local_user
+)
 from authentication import (
     login_required, admin_required, generate_state, generate_nonce,
     build_authorization_url, exchange_code_for_token, get_userinfo,
-    is_user_authorized, validate_redirect_url, build_logout_url, clear_session
+    is_user_authorized, validate_redirect_url, build_logout_url, clear_session,
+    get_current_user_features
 )
 from security import csrf_protect, generate_csrf_token, sanitize_input
+from json_provider import OrjsonProvider, ORJSON_AVAILABLE
 
 # Import route blueprints  
 from routes.shopping import shopping_bp
+from routes.chores import chores_bp
+from routes.bills import bills_bp
+from routes.expiry import expiry_bp
+from routes.admin import admin_bp
 
 import logging
 import os
+from collections.abc import Mapping
+from datetime import datetime
+from functools import lru_cache
+from types import MappingProxyType
+
+# Import Flask-Compress with fallback to uncompressed responses
+try:
+    from flask_compress import Compress
+    COMPRESS_AVAILABLE = True
+except ImportError:
+    COMPRESS_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
+# Compress static assets and JSON only; HTML pages carry the CSRF token, so they are
+# left uncompressed to rule out BREACH-style length oracles
+COMPRESS_MIMETYPES = [
+    'text/css', 'text/javascript', 'application/javascript',
+    'application/json', 'application/manifest+json',
+]
+
+# Shared, read-only template contexts for the user features context processor
+_DEFAULT_FEATURES = MappingProxyType({
+    'shopping': True,
+    'chores': True,
+    'tracker': True,
+    'bills': True,
+    'budget': True
+})
+_EMPTY_FEATURES_CTX = MappingProxyType({'user_features': MappingProxyType({})})
+
+class LazyUserFeatures(Mapping):
+    """Feature visibility mapping that loads from the database on first access"""
+    
+    def _features(self):
+        # Shares the per-request load with the feature_required decorator
+        try:
+            return get_current_user_features()
+        except Exception as e:
+            logger.error(f"Error loading user features: {e}")
+            # Return all features visible as fallback
+            g._user_features = _DEFAULT_FEATURES
+            return _DEFAULT_FEATURES
+    
+    def __getitem__(self, feature_name):
+        return self._features()[feature_name]
+    
+    def __iter__(self):
+        return iter(self._features())
+    
+    def __len__(self):
+        return len(self._features())
+
+# Fallback formats for date strings that datetime.fromisoformat() rejects
+DATE_INPUT_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f')
+
+@lru_cache(maxsize=4096)
+def _format_date_string(date_string, format_str):
+    """Parse a date string and format it for display (memoized, pages repeat dates)"""
+    try:
+        dt = datetime.fromisoformat(date_string)
+    except ValueError:
+        for fmt in DATE_INPUT_FORMATS:
+            try:
+                dt = datetime.strptime(date_string, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            return date_string
+    return dt.strftime(format_str)
+
 def create_app():
     """Application factory"""
     # Initialize Flask app
@@ -42,14 +122,45 @@ def create_app():
     app_config = get_app_config()
     app.config.update(app_config)
     
-    # Initialize rate limiting
-    limiter = Limiter(app=app, key_func=get_remote_address, default_limits=["1000 per hour"])
+    # Share compiled templates between workers and restarts instead of re-parsing them
+    jinja_cache_dir = app_config['JINJA_CACHE_DIR']
+    if jinja_cache_dir:
+        os.makedirs(jinja_cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir or None)
+    
+    # Serialize JSON responses with orjson when available
+    if ORJSON_AVAILABLE:
+        app.json = OrjsonProvider(app)
+    else:
+        logger.warning("orjson not available - JSON responses will use the standard library encoder")
+    
+    # Compress responses (brotli or gzip, as the client accepts) when available
+    if COMPRESS_AVAILABLE:
+        app.config.setdefault('COMPRESS_MIMETYPES', COMPRESS_MIMETYPES)
+        
+        # Registered before Compress so it runs after it: compressed responses get a
+        # suffixed ETag ("...:br"), which this matches so revalidations still get a 304
+        @app.after_request
+        def revalidate_compressed(response):
+            return response.make_conditional(request)
+        
+        Compress(app)
+    else:
+        logger.warning("flask-compress not available - responses will be sent uncompressed")
+    
+    # Initialize rate limiting (applied only to authentication endpoints)
+    limiter = Limiter(
+        app=app,
+        key_func=get_remote_address,
+        storage_uri=app_config['RATELIMIT_STORAGE_URI'],
+        strategy=app_config['RATELIMIT_STRATEGY'],
+    )
     
     # Initialize database
     init_db()
+    app.teardown_appcontext(release_db_connection)
     
-    # Load runtime configuration
-    oidc_config = get_oidc_configuration()
+    # Load runtime configuration (OIDC discovery runs lazily on the first login)
     access_control = load_access_control()
     
     # Template context processor
@@ -60,28 +171,16 @@ def create_app():
     # Template context processor for currency symbol
     @app.context_processor
     def inject_currency():
-        return dict(currency=get_currency_symbol())
+        return dict(currency=app_config['CURRENCY'])
     
     # Template context processor for user features
     @app.context_processor
     def inject_user_features():
         """Inject user's feature visibility settings into templates"""
         if 'user' in session:
-            from database import get_all_user_features
-            try:
-                user_features = get_all_user_features(session['user']['id'])
-                return dict(user_features=user_features)
-            except Exception as e:
-                logger.error(f"Error loading user features: {e}")
-                # Return all features visible as fallback
-                return dict(user_features={
-                    'shopping': True,
-                    'chores': True,
-                    'tracker': True,
-                    'bills': True,
-                    'budget': True
-                })
-        return dict(user_features={})
+            # Only queried if the template actually reads user_features
+            return dict(user_features=LazyUserFeatures())
+        return _EMPTY_FEATURES_CTX
     
     # Add custom Jinja filters
     @app.template_filter('title_case')
@@ -89,27 +188,30 @@ def create_app():
         """Convert text to title case"""
         if not text:
             return text
-        return ' '.join(word.capitalize() for word in str(text).split())
+        return ' '.join(map(str.capitalize, str(text).split()))
     
     @app.template_filter('format_date')
     def format_date_filter(date_string, format_str='%B %d, %Y'):
         """Format date string for display"""
         if not date_string:
             return ''
-        try:
-            from datetime import datetime
-            # Handle different input formats
-            if isinstance(date_string, str):
-                # Try parsing common formats
-                for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f']:
-                    try:
-                        dt = datetime.strptime(date_string, fmt)
-                        return dt.strftime(format_str)
-                    except ValueError:
-                        continue
-            return str(date_string)
-        except Exception:
-            return str(date_string) if date_string else ''
+        if isinstance(date_string, str):
+            return _format_date_string(date_string, format_str)
+        return str(date_string)
+    
+    def redirect_to_dashboard():
+        """Redirect to the dashboard, building its URL only once"""
+        dashboard_url = app.config.get('DASHBOARD_URL')
+        if dashboard_url is None:
+            dashboard_url = app.config['DASHBOARD_URL'] = url_for('dashboard')
+        return redirect(dashboard_url)
+    
+    @app.after_request
+    def invalidate_cached_data(response):
+        """Any write request makes cached dashboard data stale"""
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            mark_data_changed()
+        return response
     
     # ===== ERROR HANDLERS =====
     
@@ -130,10 +232,11 @@ def create_app():
     # ===== AUTHENTICATION ROUTES =====
     
     @app.route('/login')
+    @limiter.limit("30 per minute")
     def login():
         """Initiate authentication (OIDC or local)"""
         if 'user' in session:
-            return redirect(url_for('dashboard'))
+            return redirect_to_dashboard()
         
         # Check if OIDC is enabled
         if not app_config['OIDC_ENABLED']:
@@ -141,6 +244,7 @@ def create_app():
             return redirect(url_for('local_login'))
         
         # OIDC Authentication
+        oidc_config = get_oidc_configuration()
         if not oidc_config:
             flash('Authentication service is not configured', 'error')
             return render_template('login.html', oidc_enabled=True)
@@ -177,9 +281,13 @@ def create_app():
         state = request.args.get('state')
         session_state = session.get('oidc_state')
         
-        logger.info(f"Callback received - State: {state[:10] if state else 'None'}..., Session state: {session_state[:10] if session_state else 'None'}...")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Callback received - State: %s..., Session state: %s...",
+                        state[:10] if state else 'None', session_state[:10] if session_state else 'None')
         
-        if not state or state != session_state:
+        # Constant-time comparison (bytes, since the query value may not be ASCII)
+        if not state or not session_state or \
+                not secrets.compare_digest(state.encode('utf-8'), session_state.encode('utf-8')):
             if not state:
                 logger.warning(f"No state parameter in callback: {request.remote_addr}")
                 flash('Missing authentication state parameter', 'error')
@@ -200,6 +308,8 @@ def create_app():
             return redirect(url_for('login'))
         
         try:
+            oidc_config = get_oidc_configuration()
+            
             # Exchange code for token
             token_response = exchange_code_for_token(
                 oidc_config, code, app_config['BASE_URL']
@@ -211,7 +321,7 @@ def create_app():
                 return redirect(url_for('login'))
             
             # Get user information
-            userinfo = get_userinfo(oidc_config, access_token)
+            userinfo = get_userinfo(oidc_config, access_token, token_response.get('expires_in'))
             
             # Check authorization
             if not is_user_authorized(userinfo, access_control):
@@ -219,32 +329,30 @@ def create_app():
                 return render_template('unauthorized.html')
             
             # Create/update user and store in session
-            from database import create_or_update_user
             user = create_or_update_user(userinfo, access_control)
             
-            session['user'] = {
-                'id': user['id'],
-                'username': user['username'],
-                'email': user['email'],
-                'full_name': user['full_name'],
-                'is_admin': user['is_admin']
-            }
-            session['access_token'] = access_token
-            
-            # Clean up temporary session data
-            session.pop('oidc_state', None)
-            session.pop('oidc_nonce', None)
+            # Clean up temporary session data and store the user in one pass
+            next_page = session.pop('next_page', None)
+            for key in ('oidc_state', 'oidc_nonce'):
+                session.pop(key, None)
+            session.update({
+                'user': {
+                    'id': user['id'],
+                    'username': user['username'],
+                    'email': user['email'],
+                    'full_name': user['full_name'],
+                    'is_admin': user['is_admin']
+                },
+                'access_token': access_token,
+            })
             
             logger.info(f"User logged in: {user['email']}")
             
             # Redirect to originally requested page or dashboard
-            next_page = session.get('next_page', url_for('dashboard'))
-            session.pop('next_page', None)
-            
-            if validate_redirect_url(next_page, access_control['allowed_domains']):
+            if next_page and validate_redirect_url(next_page, access_control['allowed_domains']):
                 return redirect(next_page)
             else:
-                return redirect(url_for('dashboard'))
+                return redirect_to_dashboard()
         
         except Exception as e:
             logger.error(f"Authentication callback failed: {e}")
@@ -261,8 +369,8 @@ def create_app():
         flash('You have been logged out', 'info')
         
         # Build OIDC logout URL if OIDC is enabled and available
-        if app_config['OIDC_ENABLED'] and oidc_config:
-            logout_url = build_logout_url(oidc_config, app_config['BASE_URL'])
+        if app_config['OIDC_ENABLED']:
+            logout_url = build_logout_url(get_oidc_configuration(), app_config['BASE_URL'])
             if logout_url:
                 return redirect(logout_url)
         
@@ -273,7 +381,7 @@ def create_app():
     def local_login():
         """Local authentication login page with user selection"""
         if 'user' in session:
-            return redirect(url_for('dashboard'))
+            return redirect_to_dashboard()
         
         local_users = load_local_users()
         # Ensure CSRF token is generated for the session
@@ -285,11 +393,12 @@ def create_app():
                              local_users=local_users)
     
     @app.route('/local_login_auth', methods=['POST'])
+    @limiter.limit("10 per minute")
     @csrf_protect
     def local_login_auth():
         """Handle local user authentication"""
         if 'user' in session:
-            return redirect(url_for('dashboard'))
+            return redirect_to_dashboard()
         
         username = request.form.get('username')
         if not username:
@@ -297,19 +406,13 @@ def create_app():
             return redirect(url_for('local_login'))
         
         # Find the user in the local users list
-        local_users = load_local_users()
-        selected_user = None
-        for user in local_users:
-            if user['username'] == username:
-                selected_user = user
-                break
+        selected_user = get_local_user(username)
         
         if not selected_user:
             flash('User not found', 'error')
             return redirect(url_for('local_login'))
         
         # Create/update user in database and create session
-        from database import create_or_update_local_user
         user = create_or_update_local_user(selected_user)
         
         if not user:
@@ -328,7 +431,7 @@ def create_app():
         logger.info(f"Local user logged in: {user['email']}")
         
         flash(f'Welcome, {user["full_name"]}!', 'success')
-        return redirect(url_for('dashboard'))
+        return redirect_to_dashboard()
     
     # ===== MAIN ROUTES =====
     
@@ -336,7 +439,7 @@ def create_app():
     def index():
         """Home page - redirect to dashboard or login"""
         if 'user' in session:
-            return redirect(url_for('dashboard'))
+            return redirect_to_dashboard()
         return redirect(url_for('login'))
     
     @app.route('/dashboard')
@@ -344,9 +447,8 @@ def create_app():
     def dashboard():
         """Main dashboard page"""
         try:
-            stats = get_dashboard_stats()
-            recent_activities = get_recent_activities(limit=5)
-            return render_template('dashboard.html', recent_activities=recent_activities, **stats)
+            payload = get_dashboard_payload(activities_limit=5)
+            return render_template('dashboard.html', recent_activities=payload['recent_activities'], **payload['stats'])
         except Exception as e:
             logger.error(f"Dashboard error: {e}")
             flash('Error loading dashboard', 'error')
@@ -362,17 +464,13 @@ def create_app():
     @app.route('/manifest.json')
     def manifest():
         """Serve PWA manifest"""
-        return send_from_directory('static', 'manifest.json')
+        return send_from_directory('static', 'manifest.json', mimetype='application/manifest+json',
+                                   max_age=86400, conditional=True)
     
     # ===== REGISTER BLUEPRINTS =====
     
     # Register route modules
     app.register_blueprint(shopping_bp)
-    
-    from routes.chores import chores_bp
-    from routes.bills import bills_bp 
-    from routes.expiry import expiry_bp
-    from routes.admin import admin_bp
     app.register_blueprint(chores_bp)
     app.register_blueprint(bills_bp)
     app.register_blueprint(expiry_bp)
@@ -385,5 +483,4 @@ app = create_app()
 
 if __name__ == '__main__':
     # Development server
-    app.run(debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true', 
-            host='0.0.0.0', port=int(os.getenv('PORT', '5000')))
\ No newline at end of file
+    app.run(debug=app.config['DEBUG'], host='0.0.0.0', port=app.config['PORT'])
\ No newline at end of file
@@ -2,16 +2,48 @@
 Authentication utilities for Homie Flask application
 """
 import secrets
+import hashlib
 import logging
+import threading
+import time
 from urllib.parse import urlencode, parse_qs, urlparse
 from functools import wraps
-from flask import session, request, redirect, url_for, jsonify, flash
+from flask import session, request, redirect, url_for, jsonify, flash, current_app, g
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TLRUCache
 from security import csrf_protect
-from config import is_oidc_enabled
+from database import get_all_user_features
 
 logger = logging.getLogger(__name__)
 
+# Token and userinfo calls go to the same provider; a shared session keeps the connection alive between them.
+# Retry's default methods exclude POST, so a single-use authorization code is never replayed.
+_oidc_session = requests.Session()
+_oidc_session.mount('https://', HTTPAdapter(
+    pool_connections=4, pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=(502, 503, 504))
+))
+
+# (connect, read) timeouts for provider calls, in seconds
+OIDC_REQUEST_TIMEOUT = (3.05, 10)
+
+# Userinfo responses keyed by a hash of the access token (raw tokens are never stored).
+# Entries are stored as (expires_at, userinfo) and live until the token expires, capped at
+# USERINFO_CACHE_TTL, which roughly matches a typical access token lifetime.
+USERINFO_CACHE_TTL = 1800
+_userinfo_cache = TLRUCache(maxsize=10000, ttu=lambda key, value, now: value[0], timer=time.monotonic)
+_userinfo_cache_lock = threading.Lock()
+
+def _parse_json_response(response):
+    """Parse a provider response body with the app's JSON provider (orjson when available)"""
+    return current_app.json.loads(response.content)
+
+def _token_cache_key(access_token):
+    """Derive a cache key from an access token"""
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+
 class AuthenticationError(Exception):
     """Custom exception for authentication errors"""
     pass
@@ -54,34 +86,58 @@ def exchange_code_for_token(oidc_config, code, base_url):
     }
     
     try:
-        response = requests.post(
+        response = _oidc_session.post(
             oidc_config['token_endpoint'],
             data=token_data,
             headers={'Content-Type': 'application/x-www-form-urlencoded'},
-            timeout=10
+            timeout=OIDC_REQUEST_TIMEOUT
         )
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        return _parse_json_response(response)
+    except (requests.RequestException, ValueError) as e:
         logger.error(f"Token exchange failed: {e}")
         raise AuthenticationError("Failed to exchange code for token")
 
-def get_userinfo(oidc_config, access_token):
-    """Get user information from OIDC provider"""
+def get_userinfo(oidc_config, access_token, expires_in=None):
+    """Get user information from OIDC provider, cached per access token until it expires"""
     if not oidc_config:
         raise AuthenticationError("OIDC configuration not available")
     
+    cache_key = _token_cache_key(access_token)
+    with _userinfo_cache_lock:
+        cached = _userinfo_cache.get(cache_key)
+    if cached is not None:
+        return cached[1]
+    
     try:
-        response = requests.get(
+        response = _oidc_session.get(
             oidc_config['userinfo_endpoint'],
             headers={'Authorization': f'Bearer {access_token}'},
-            timeout=10
+            timeout=OIDC_REQUEST_TIMEOUT
         )
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
+        userinfo = _parse_json_response(response)
+    except (requests.RequestException, ValueError) as e:
         logger.error(f"Userinfo request failed: {e}")
         raise AuthenticationError("Failed to get user information")
+    
+    # Never keep userinfo past the token's own lifetime (expires_in from the token response)
+    ttl = USERINFO_CACHE_TTL
+    try:
+        ttl = min(ttl, int(expires_in))
+    except (TypeError, ValueError):
+        pass
+    if ttl > 0:
+        with _userinfo_cache_lock:
+            _userinfo_cache[cache_key] = (time.monotonic() + ttl, userinfo)
+    return userinfo
+
+def invalidate_userinfo(access_token):
+    """Drop any cached userinfo for an access token"""
+    if not access_token:
+        return
+    with _userinfo_cache_lock:
+        _userinfo_cache.pop(_token_cache_key(access_token), None)
 
 def is_user_authorized(userinfo, access_control):
     """
@@ -98,10 +154,10 @@ def is_user_authorized(userinfo, access_control):
             user_groups = [user_groups]
         
         # Check if user is in any of the allowed groups
-        for group in user_groups:
-            if group in access_control['allowed_groups']:
-                logger.info(f"User authorized via group: {group}")
-                return True
+        matched_groups = access_control['allowed_groups'].intersection(user_groups)
+        if matched_groups:
+            logger.info(f"User authorized via group: {', '.join(sorted(matched_groups))}")
+            return True
         
         logger.warning(f"User not in any allowed groups. User groups: {user_groups}")
         return False
@@ -113,7 +169,7 @@ def is_user_authorized(userinfo, access_control):
             logger.warning("User has no email in userinfo")
             return False
         
-        if email in access_control['allowed_emails']:
+        if email.lower() in access_control['allowed_emails']:
             logger.info(f"User authorized via email: {email}")
             return True
         
@@ -129,7 +185,7 @@ def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user' not in session:
-            if is_oidc_enabled():
+            if current_app.config['OIDC_ENABLED']:
                 return redirect(url_for('login'))
             else:
                 # When OIDC is disabled, redirect to local login (to be implemented)
@@ -160,24 +216,28 @@ def api_auth_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def get_current_user_features():
+    """Get the logged-in user's feature visibility, loaded once per request"""
+    features = g.get('_user_features')
+    if features is None:
+        features = g._user_features = get_all_user_features(session['user']['id'])
+    return features
+
 def feature_required(feature_name):
     """Decorator to require a specific feature to be enabled for the user"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             if 'user' not in session:
-                if is_oidc_enabled():
+                if current_app.config['OIDC_ENABLED']:
                     return redirect(url_for('login'))
                 else:
                     return redirect(url_for('local_login'))
             
-            # Import here to avoid circular imports
-            from database import get_user_feature_visibility
-            
             user_id = session['user']['id']
             
             # Check if user has access to this feature
-            if not get_user_feature_visibility(user_id, feature_name):
+            if not get_current_user_features().get(feature_name, True):
                 logger.warning(f"User {user_id} attempted to access disabled feature: {feature_name}")
                 return redirect(url_for('unauthorized'))
             
@@ -219,4 +279,4 @@ def clear_session():
     session.pop('user', None)
     session.pop('oidc_state', None) 
     session.pop('oidc_nonce', None)
-    session.pop('access_token', None)
\ No newline at end of file
+    invalidate_userinfo(session.pop('access_token', None))
\ No newline at end of file
@@ -3,18 +3,36 @@ Configuration utilities for Homie Flask application
 """
 import os
 import json
+import time
+import hashlib
 import logging
+import tempfile
 import requests
 from urllib.parse import urljoin
 
 logger = logging.getLogger(__name__)
 
+# How long a discovered OIDC configuration is reused before re-fetching (seconds)
+OIDC_CONFIG_TTL = int(os.getenv('OIDC_CONFIG_TTL', '3600'))
+
+# Optional directory where discovered endpoints are persisted so worker restarts skip discovery
+OIDC_CACHE_DIR = os.getenv('OIDC_CACHE_DIR', '')
+
+# Cached OIDC configurations keyed by provider base URL: {base_url: (fetched_at, config)}
+_oidc_config_cache = {}
+
+# Client credentials always come from the environment and are never written to the disk cache
+OIDC_CREDENTIAL_KEYS = ('client_id', 'client_secret')
+
+# Parsed local users as (USERS value, users, users_by_username)
+_local_users_cache = None
+
 def is_oidc_enabled():
     """Check if OIDC authentication is enabled"""
     return os.getenv('OIDC_ENABLED', 'true').lower() == 'true'
 
 def get_oidc_configuration():
-    """Get OIDC configuration with auto-discovery"""
+    """Get OIDC configuration, reusing the cached discovery result until it expires"""
     # Check if OIDC is enabled
     if not is_oidc_enabled():
         logger.info("OIDC authentication is disabled")
@@ -25,6 +43,63 @@ def get_oidc_configuration():
         logger.error("OIDC_BASE_URL environment variable is required when OIDC is enabled")
         return None
     
+    cached = _oidc_config_cache.get(oidc_base_url) or _load_oidc_disk_cache(oidc_base_url)
+    if cached and time.monotonic() - cached[0] < OIDC_CONFIG_TTL:
+        _oidc_config_cache[oidc_base_url] = cached
+        return cached[1]
+    
+    config = _discover_oidc_configuration(oidc_base_url)
+    
+    # Only cache successful lookups so a provider outage is retried on the next login
+    if config:
+        _oidc_config_cache[oidc_base_url] = (time.monotonic(), config)
+        _save_oidc_disk_cache(oidc_base_url, config)
+    return config
+
+def _oidc_disk_cache_path(oidc_base_url):
+    """Get the disk cache file for a provider base URL"""
+    digest = hashlib.sha1(oidc_base_url.encode('utf-8')).hexdigest()
+    return os.path.join(OIDC_CACHE_DIR, f"oidc-{digest}.json")
+
+def _load_oidc_disk_cache(oidc_base_url):
+    """Load (fetched_at, config) persisted by another process, or None"""
+    if not OIDC_CACHE_DIR:
+        return None
+    
+    path = _oidc_disk_cache_path(oidc_base_url)
+    try:
+        # The file's age maps onto this process's monotonic clock
+        age = time.time() - os.path.getmtime(path)
+        with open(path, encoding='utf-8') as f:
+            endpoints = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    config = {
+        'client_id': os.getenv('OIDC_CLIENT_ID', ''),
+        'client_secret': os.getenv('OIDC_CLIENT_SECRET', ''),
+    }
+    config.update(endpoints)
+    return (time.monotonic() - age, config)
+
+def _save_oidc_disk_cache(oidc_base_url, config):
+    """Persist discovered endpoints (without credentials) for other processes"""
+    if not OIDC_CACHE_DIR:
+        return
+    
+    endpoints = {k: v for k, v in config.items() if k not in OIDC_CREDENTIAL_KEYS}
+    try:
+        os.makedirs(OIDC_CACHE_DIR, exist_ok=True)
+        # Write to a temporary file and rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=OIDC_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(endpoints, f)
+        os.replace(tmp_path, _oidc_disk_cache_path(oidc_base_url))
+    except OSError as e:
+        logger.warning(f"Could not write OIDC discovery cache: {e}")
+
+def _discover_oidc_configuration(oidc_base_url):
+    """Fetch OIDC configuration with auto-discovery, falling back to manual settings"""
     # Build complete OIDC config with client credentials
     config = {
         'client_id': os.getenv('OIDC_CLIENT_ID', ''),
@@ -122,30 +197,34 @@ def get_oidc_configuration():
     logger.info("Manual OIDC configuration loaded successfully")
     return config
 
+def _parse_csv_set(value):
+    """Parse a comma-separated setting into a frozenset of non-empty, stripped entries"""
+    return frozenset(entry.strip() for entry in value.split(',') if entry.strip())
+
 def load_access_control():
-    """Load access control configuration"""
+    """Load access control configuration (allow lists are frozensets for O(1) lookups)"""
     config = {
-        'allowed_emails': [],
-        'allowed_groups': [],
-        'admin_emails': []
+        'allowed_emails': frozenset(),
+        'allowed_groups': frozenset(),
+        'admin_emails': frozenset()
     }
     
     # Load admin emails
     admin_emails_str = os.getenv('ADMIN_EMAILS', '')
     if admin_emails_str:
-        config['admin_emails'] = [email.strip().lower() for email in admin_emails_str.split(',')]
+        config['admin_emails'] = _parse_csv_set(admin_emails_str.lower())
         logger.info(f"Access control: Using ADMIN_EMAILS with {len(config['admin_emails'])} admin emails")
     
     # Load allowed groups from environment variables (takes precedence)
     allowed_groups_str = os.getenv('ALLOWED_GROUPS', '')
     if allowed_groups_str:
-        config['allowed_groups'] = [group.strip() for group in allowed_groups_str.split(',')]
+        config['allowed_groups'] = _parse_csv_set(allowed_groups_str)
         logger.info(f"Access control: Using ALLOWED_GROUPS with {len(config['allowed_groups'])} groups")
     else:
         # Load allowed emails only if groups are not configured
         allowed_emails_str = os.getenv('ALLOWED_EMAILS', '')
         if allowed_emails_str:
-            config['allowed_emails'] = [email.strip() for email in allowed_emails_str.split(',')]
+            config['allowed_emails'] = _parse_csv_set(allowed_emails_str.lower())
             logger.info(f"Access control: Using ALLOWED_EMAILS with {len(config['allowed_emails'])} emails")
         else:
             logger.warning("No access control configured (neither ALLOWED_GROUPS nor ALLOWED_EMAILS)")
@@ -163,8 +242,29 @@ def load_access_control():
 
 def load_local_users():
     """Load local users configuration for non-OIDC authentication"""
-    users = []
+    return _get_local_users_cache()[1]
+
+def get_local_user(username):
+    """Look up a configured local user by username"""
+    return _get_local_users_cache()[2].get(username)
+
+def _get_local_users_cache():
+    """Return (source, users, users_by_username), re-parsing only when USERS changes"""
+    global _local_users_cache
+    
     users_str = os.getenv('USERS', '')
+    cache = _local_users_cache
+    if cache is None or cache[0] != users_str:
+        users = _parse_local_users(users_str)
+        users_by_username = {}
+        for user in users:
+            users_by_username.setdefault(user['username'], user)
+        cache = _local_users_cache = (users_str, users, users_by_username)
+    return cache
+
+def _parse_local_users(users_str):
+    """Parse the USERS setting into a list of local user dicts"""
+    users = []
     
     if users_str:
         user_entries = [entry.strip() for entry in users_str.split(',')]
@@ -212,7 +312,7 @@ def get_currency_symbol():
     return os.getenv('CURRENCY', '£')
 
 def get_app_config():
-    """Get Flask application configuration"""
+    """Get Flask application configuration (environment is read once, at startup)"""
     return {
         'SECRET_KEY': os.getenv('SECRET_KEY', 'dev-key-change-in-production'),
         'OIDC_ENABLED': is_oidc_enabled(),
@@ -220,17 +320,25 @@ def get_app_config():
         'OIDC_CLIENT_SECRET': os.getenv('OIDC_CLIENT_SECRET', ''),
         'OIDC_BASE_URL': os.getenv('OIDC_BASE_URL', ''),
         'BASE_URL': os.getenv('BASE_URL', 'http://localhost:5000'),
-        'RATELIMIT_STORAGE_URI': 'memory://',  # Use Redis in production
+        'RATELIMIT_STORAGE_URI': os.getenv('RATELIMIT_STORAGE_URI', 'memory://'),  # Use Redis in production
+        'RATELIMIT_STRATEGY': 'fixed-window',
         'SESSION_COOKIE_SECURE': os.getenv('SESSION_COOKIE_SECURE', 'False').lower() == 'true',
         'SESSION_COOKIE_HTTPONLY': True,
         'SESSION_COOKIE_SAMESITE': 'Lax',
         'PERMANENT_SESSION_LIFETIME': 3600,  # 1 hour
         'MAX_CONTENT_LENGTH': 16 * 1024 * 1024,  # 16MB max upload
         'DEBUG': os.getenv('FLASK_DEBUG', 'False').lower() == 'true',
+        'PORT': int(os.getenv('PORT', '5000')),
+        'CURRENCY': get_currency_symbol(),
+        'JINJA_CACHE_DIR': os.getenv('JINJA_CACHE_DIR', ''),  # Defaults to a directory under the system temp dir
     }
 
 def setup_logging():
-    """Setup application logging"""
+    """Setup application logging (safe to call more than once)"""
+    # Don't stack another handler if logging was already configured
+    if logging.getLogger().handlers:
+        return
+    
     log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
     log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     
@@ -4,8 +4,14 @@ Database utilities for Homie Flask application
 
 import logging
 import os
+import queue
 import sqlite3
-from datetime import UTC, datetime
+import threading
+import time
+from itertools import groupby
+from operator import itemgetter
+
+from flask import g, has_app_context
 
 from config import get_currency_symbol
 
@@ -23,13 +29,94 @@ else:  # Linux/Mac local development
     DATABASE = "./data/homie.db"
 
 
-def get_db_connection():
-    """Get database connection with row factory"""
-    conn = sqlite3.connect(DATABASE)
+# Per-connection tuning; journal_mode=WAL is persistent and set once in init_db()
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",  # Safe with WAL, avoids an fsync per commit
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA cache_size=-20000",  # ~20MB page cache
+    "PRAGMA busy_timeout=5000",
+)
+
+
+# Version of the schema created by init_db(), stored in the database's user_version.
+# Bump it whenever the tables, migrations or indexes in init_db() change.
+SCHEMA_VERSION = 2
+
+
+# Idle connections kept open between requests so SQLite's page and statement caches stay warm
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+_connection_pool = queue.LifoQueue(maxsize=DATABASE_POOL_SIZE)
+
+# Prepared statements kept per connection; sized above the number of distinct
+# statements the app issues so none are evicted and re-parsed between requests
+STATEMENT_CACHE_SIZE = 256
+
+
+# Dashboard payloads keyed by activities limit: {limit: (write_generation, fetched_at, payload)}.
+# The cache and write generation are per worker: writes handled by another gunicorn worker
+# are not seen here, so the dashboard can be up to DASHBOARD_CACHE_TTL seconds stale after them
+DASHBOARD_CACHE_TTL = 5  # seconds
+_dashboard_cache = {}
+_dashboard_cache_lock = threading.Lock()
+_write_generation = 0
+
+
+def _connect():
+    """Open a new database connection with row factory and tuning pragmas"""
+    # Pooled connections are handed between worker threads, one request at a time
+    conn = sqlite3.connect(
+        DATABASE, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+    )
     conn.row_factory = sqlite3.Row
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _close_connection(conn):
+    """Close a connection, letting SQLite refresh planner statistics first"""
+    try:
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error:
+        pass
+    conn.close()
+
+
+def get_db_connection():
+    """Get the database connection for the current request.
+
+    Within a request the same pooled connection is returned on every call and
+    released by release_db_connection() at teardown, so callers must not close it.
+    Outside of an application context a new connection is returned.
+    """
+    if not has_app_context():
+        return _connect()
+
+    conn = g.get("_db_conn")
+    if conn is None:
+        try:
+            conn = _connection_pool.get_nowait()
+        except queue.Empty:
+            conn = _connect()
+        g._db_conn = conn
     return conn
 
 
+def release_db_connection(exception=None):
+    """Return the request's connection to the pool (app context teardown handler)"""
+    conn = g.pop("_db_conn", None)
+    if conn is None:
+        return
+
+    try:
+        # Discard anything a failed request left uncommitted
+        conn.rollback()
+        _connection_pool.put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        _close_connection(conn)
+
+
 def init_db():
     """Initialize the database with required tables"""
     # Ensure the data directory exists
@@ -39,7 +126,27 @@ def init_db():
         logger.info(f"Created database directory: {db_dir}")
 
     logger.info(f"Using database: {DATABASE}")
-    conn = get_db_connection()
+    conn = _connect()
+
+    # Skip the schema setup entirely once this version has been applied
+    if _get_schema_version(conn) >= SCHEMA_VERSION:
+        logger.info(f"Database schema is up to date (version {SCHEMA_VERSION})")
+        _close_connection(conn)
+        return
+
+    # Write-ahead logging lets readers proceed while a write is in progress.
+    # The journal mode is stored in the database file, so this only needs to run here.
+    conn.execute("PRAGMA journal_mode=WAL")
+
+    # Run the whole schema setup as one transaction: one commit instead of one per
+    # statement, and concurrent workers starting up wait for each other here
+    conn.execute("BEGIN IMMEDIATE")
+
+    # Another worker may have finished the setup while this one was waiting
+    if _get_schema_version(conn) >= SCHEMA_VERSION:
+        conn.rollback()
+        _close_connection(conn)
+        return
 
     # Users table (simplified for OIDC-only)
     conn.execute("""
@@ -169,43 +276,56 @@ def init_db():
         )
     """)
 
-    # Add missing columns to existing tables (migrations)
-    try:
-        conn.execute(
-            "ALTER TABLE shopping_items ADD COLUMN completed BOOLEAN DEFAULT FALSE"
-        )
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-
-    try:
-        conn.execute("ALTER TABLE shopping_items ADD COLUMN completed_by INTEGER")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
+    # Add columns missing from tables created by older versions (migrations)
+    migrations = {
+        "shopping_items": {
+            "completed": "ALTER TABLE shopping_items ADD COLUMN completed BOOLEAN DEFAULT FALSE",
+            "completed_by": "ALTER TABLE shopping_items ADD COLUMN completed_by INTEGER",
+            "completed_at": "ALTER TABLE shopping_items ADD COLUMN completed_at TIMESTAMP",
+        },
+        "bills": {
+            "category": "ALTER TABLE bills ADD COLUMN category TEXT DEFAULT 'Other'",
+            "is_recurring": "ALTER TABLE bills ADD COLUMN is_recurring BOOLEAN DEFAULT TRUE",
+            "recurrence_pattern": "ALTER TABLE bills ADD COLUMN recurrence_pattern TEXT DEFAULT 'monthly'",
+            "is_paid": "ALTER TABLE bills ADD COLUMN is_paid BOOLEAN DEFAULT FALSE",
+            "paid_date": "ALTER TABLE bills ADD COLUMN paid_date DATE",
+            "paid_by": "ALTER TABLE bills ADD COLUMN paid_by INTEGER",
+        },
+    }
 
-    try:
-        conn.execute("ALTER TABLE shopping_items ADD COLUMN completed_at TIMESTAMP")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
+    for table, columns in migrations.items():
+        existing_columns = {
+            row["name"] for row in conn.execute(f"PRAGMA table_info({table})")
+        }
+        for column, sql in columns.items():
+            if column not in existing_columns:
+                logger.info(f"Adding column {table}.{column}")
+                conn.execute(sql)
+
+    # Indexes for the list pages, dashboard counts, activity feed, monthly spending
+    # and the recurring bill duplicate check
+    # (created after the migrations above so every indexed column exists)
+    indexes = [
+        "CREATE INDEX IF NOT EXISTS idx_shopping_items_status ON shopping_items (completed, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_shopping_items_created_at ON shopping_items (created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_chores_status ON chores (completed, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_expiry_items_expiry_date ON expiry_items (expiry_date)",
+        "CREATE INDEX IF NOT EXISTS idx_expiry_items_created_at ON expiry_items (created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_bills_unpaid ON bills (is_paid, due_day)",
+        "CREATE INDEX IF NOT EXISTS idx_bills_created_at ON bills (created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_bills_paid_date ON bills (is_paid, paid_date)",
+        "CREATE INDEX IF NOT EXISTS idx_bills_name ON bills (bill_name, added_by)",
+    ]
 
-    # Bills table migrations
-    bills_columns = {
-        "category": "ALTER TABLE bills ADD COLUMN category TEXT DEFAULT 'Other'",
-        "is_recurring": "ALTER TABLE bills ADD COLUMN is_recurring BOOLEAN DEFAULT TRUE",
-        "recurrence_pattern": "ALTER TABLE bills ADD COLUMN recurrence_pattern TEXT DEFAULT 'monthly'",
-        "is_paid": "ALTER TABLE bills ADD COLUMN is_paid BOOLEAN DEFAULT FALSE",
-        "paid_date": "ALTER TABLE bills ADD COLUMN paid_date DATE",
-        "paid_by": "ALTER TABLE bills ADD COLUMN paid_by INTEGER",
-    }
+    for sql in indexes:
+        conn.execute(sql)
 
-    for column, sql in bills_columns.items():
-        try:
-            conn.execute(sql)
-            conn.commit()
-        except sqlite3.OperationalError:
-            pass
+    # Gather planner statistics once; PRAGMA optimize keeps them current afterwards
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone()
+    if not has_stats:
+        conn.execute("ANALYZE")
 
     # Insert default budget categories only if none exist
     existing_categories = conn.execute(
@@ -221,240 +341,248 @@ def init_db():
             ("Other", 0, "#6B7280"),
         ]
 
-        for cat_name, limit, color in default_categories:
-            try:
-                conn.execute(
-                    """
-                    INSERT INTO budget_categories (name, monthly_limit, color)
-                    VALUES (?, ?, ?)
-                """,
-                    (cat_name, limit, color),
-                )
-            except sqlite3.OperationalError:
-                pass
+        try:
+            conn.executemany(
+                """
+                INSERT INTO budget_categories (name, monthly_limit, color)
+                VALUES (?, ?, ?)
+            """,
+                default_categories,
+            )
+        except sqlite3.OperationalError:
+            pass
 
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
-    conn.close()
+    logger.info(f"Database schema updated to version {SCHEMA_VERSION}")
+
+    _close_connection(conn)
+
+
+def _get_schema_version(conn):
+    """Get the schema version recorded in the database file"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def mark_data_changed():
+    """Invalidate cached dashboard data after a write"""
+    global _write_generation
+    _write_generation += 1
+
+
+def get_dashboard_payload(activities_limit=5):
+    """Get dashboard stats and recent activities, cached briefly between writes"""
+    with _dashboard_cache_lock:
+        # Holding the lock while querying means concurrent loads share one query
+        generation = _write_generation
+        cached = _dashboard_cache.get(activities_limit)
+        if (
+            cached
+            and cached[0] == generation
+            and time.monotonic() - cached[1] < DASHBOARD_CACHE_TTL
+        ):
+            return cached[2]
+
+        conn = get_db_connection()
+        payload = {
+            "stats": _fetch_dashboard_stats(conn),
+            "recent_activities": _fetch_recent_activities(conn, activities_limit),
+        }
+        _dashboard_cache[activities_limit] = (generation, time.monotonic(), payload)
+        return payload
 
 
 def get_dashboard_stats():
     """Get counts for dashboard stats"""
-    conn = get_db_connection()
+    return _fetch_dashboard_stats(get_db_connection())
 
-    # Get counts for dashboard stats
-    shopping_count = conn.execute(
-        "SELECT COUNT(*) as count FROM shopping_items WHERE completed = 0 OR completed IS NULL"
-    ).fetchone()["count"]
-    chores_count = conn.execute(
-        "SELECT COUNT(*) as count FROM chores WHERE completed = 0 OR completed IS NULL"
-    ).fetchone()["count"]
-    expiring_count = conn.execute("""
-        SELECT COUNT(*) as count FROM expiry_items
-        WHERE expiry_date BETWEEN date('now') AND date('now', '+30 days')
-    """).fetchone()["count"]
-
-    # Get monthly bills total
-    bills_total = (
-        conn.execute("SELECT SUM(amount) as total FROM bills").fetchone()["total"] or 0
-    )
 
-    conn.close()
+def _fetch_dashboard_stats(conn):
+    """Query dashboard counts using an open connection"""
+    # All counts and the monthly bills total in a single statement
+    stats = conn.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM shopping_items
+             WHERE completed = 0 OR completed IS NULL) as shopping_count,
+            (SELECT COUNT(*) FROM chores
+             WHERE completed = 0 OR completed IS NULL) as chores_count,
+            (SELECT COUNT(*) FROM expiry_items
+             WHERE expiry_date BETWEEN date('now') AND date('now', '+30 days')) as expiring_count,
+            (SELECT COALESCE(SUM(amount), 0) FROM bills) as monthly_total
+    """).fetchone()
 
-    return {
-        "shopping_count": shopping_count,
-        "chores_count": chores_count,
-        "expiring_count": expiring_count,
-        "monthly_total": bills_total,
-    }
+    return dict(stats)
 
 
 def get_recent_activities(limit=10):
     """Get recent activities across all modules for dashboard display"""
-    conn = get_db_connection()
+    return _fetch_recent_activities(get_db_connection(), limit)
+
+
+# Activity feed entries by (kind, done): (description template, icon, type)
+ACTIVITY_FORMATS = {
+    ("shopping", True): (
+        "{username} completed shopping item: {name}",
+        "fa-check-circle",
+        "shopping_completed",
+    ),
+    ("shopping", False): (
+        "{username} added shopping item: {name}",
+        "fa-shopping-cart",
+        "shopping_added",
+    ),
+    ("chore", True): (
+        "{username} completed chore: {name}",
+        "fa-check-circle",
+        "chore_completed",
+    ),
+    ("chore", False): ("{username} added chore: {name}", "fa-tasks", "chore_added"),
+    ("expiry", False): (
+        "{username} added expiry tracker: {name} (expires {detail})",
+        "fa-calendar-times",
+        "expiry_added",
+    ),
+    ("bill", False): (
+        "{username} added bill: {name} ({currency}{detail})",
+        "fa-receipt",
+        "bill_added",
+    ),
+}
+
+
+def _fetch_recent_activities(conn, limit):
+    """Query and format recent activities using an open connection"""
     activities = []
 
     try:
         logger.info(f"Getting recent activities with limit: {limit}")
-        # Get recent shopping items added
-        shopping_items = conn.execute(
+        # The newest rows of each table (index-ordered), merged and sorted by SQLite.
+        # Completed items are reported at their completion time.
+        rows = conn.execute(
             """
             SELECT
-                'shopping' as type,
-                item_name,
-                u.username,
-                s.created_at,
-                completed,
-                completed_at
-            FROM shopping_items s
-            LEFT JOIN users u ON s.added_by = u.id
-            ORDER BY s.created_at DESC
-            LIMIT ?
-        """,
-            (limit,),
-        ).fetchall()
-
-        logger.info(f"Found {len(shopping_items)} shopping items")
-
-        for item in shopping_items:
-            if item["completed"] and item["completed_at"]:
-                activities.append(
-                    {
-                        "description": f"{item['username']} completed shopping item: {item['item_name']}",
-                        "time": item["completed_at"],
-                        "icon": "fa-check-circle",
-                        "type": "shopping_completed",
-                    }
+                kind,
+                done,
+                username,
+                name,
+                detail,
+                time,
+                CAST((julianday('now') - julianday(time)) * 86400 AS INTEGER) as age_seconds
+            FROM (
+                SELECT * FROM (
+                    SELECT
+                        'shopping' as kind,
+                        s.completed AND s.completed_at IS NOT NULL as done,
+                        u.username,
+                        s.item_name as name,
+                        NULL as detail,
+                        CASE WHEN s.completed AND s.completed_at IS NOT NULL
+                            THEN s.completed_at ELSE s.created_at END as time
+                    FROM shopping_items s
+                    LEFT JOIN users u ON s.added_by = u.id
+                    ORDER BY s.created_at DESC
+                    LIMIT :limit
                 )
-            else:
-                activities.append(
-                    {
-                        "description": f"{item['username']} added shopping item: {item['item_name']}",
-                        "time": item["created_at"],
-                        "icon": "fa-shopping-cart",
-                        "type": "shopping_added",
-                    }
+                UNION ALL
+                SELECT * FROM (
+                    SELECT
+                        'chore' as kind,
+                        c.completed AND c.completed_at IS NOT NULL as done,
+                        CASE WHEN c.completed AND c.completed_at IS NOT NULL
+                            THEN u2.username ELSE u1.username END as username,
+                        c.chore_name as name,
+                        NULL as detail,
+                        CASE WHEN c.completed AND c.completed_at IS NOT NULL
+                            THEN c.completed_at ELSE c.created_at END as time
+                    FROM chores c
+                    LEFT JOIN users u1 ON c.added_by = u1.id
+                    LEFT JOIN users u2 ON c.completed_by = u2.id
+                    ORDER BY COALESCE(c.completed_at, c.created_at) DESC
+                    LIMIT :limit
                 )
-
-        # Get recent chores
-        chores = conn.execute(
-            """
-            SELECT
-                'chore' as type,
-                chore_name,
-                u1.username as added_by_username,
-                u2.username as completed_by_username,
-                c.created_at,
-                completed,
-                completed_at
-            FROM chores c
-            LEFT JOIN users u1 ON c.added_by = u1.id
-            LEFT JOIN users u2 ON c.completed_by = u2.id
-            ORDER BY COALESCE(completed_at, c.created_at) DESC
-            LIMIT ?
-        """,
-            (limit,),
-        ).fetchall()
-
-        for chore in chores:
-            if chore["completed"] and chore["completed_at"]:
-                activities.append(
-                    {
-                        "description": f"{chore['completed_by_username']} completed chore: {chore['chore_name']}",
-                        "time": chore["completed_at"],
-                        "icon": "fa-check-circle",
-                        "type": "chore_completed",
-                    }
+                UNION ALL
+                SELECT * FROM (
+                    SELECT
+                        'expiry' as kind,
+                        0 as done,
+                        u.username,
+                        e.item_name as name,
+                        e.expiry_date as detail,
+                        e.created_at as time
+                    FROM expiry_items e
+                    LEFT JOIN users u ON e.added_by = u.id
+                    ORDER BY e.created_at DESC
+                    LIMIT :limit
                 )
-            else:
-                activities.append(
-                    {
-                        "description": f"{chore['added_by_username']} added chore: {chore['chore_name']}",
-                        "time": chore["created_at"],
-                        "icon": "fa-tasks",
-                        "type": "chore_added",
-                    }
+                UNION ALL
+                SELECT * FROM (
+                    SELECT
+                        'bill' as kind,
+                        0 as done,
+                        u.username,
+                        b.bill_name as name,
+                        b.amount as detail,
+                        b.created_at as time
+                    FROM bills b
+                    LEFT JOIN users u ON b.added_by = u.id
+                    ORDER BY b.created_at DESC
+                    LIMIT :limit
                 )
-
-        # Get recent expiry items
-        expiry_items = conn.execute(
-            """
-            SELECT
-                'expiry' as type,
-                item_name,
-                expiry_date,
-                u.username,
-                e.created_at
-            FROM expiry_items e
-            LEFT JOIN users u ON e.added_by = u.id
-            ORDER BY e.created_at DESC
-            LIMIT ?
-        """,
-            (limit,),
-        ).fetchall()
-
-        for item in expiry_items:
-            activities.append(
-                {
-                    "description": f"{item['username']} added expiry tracker: {item['item_name']} (expires {item['expiry_date']})",
-                    "time": item["created_at"],
-                    "icon": "fa-calendar-times",
-                    "type": "expiry_added",
-                }
             )
-
-        # Get recent bills
-        bills = conn.execute(
-            """
-            SELECT
-                'bill' as type,
-                bill_name,
-                amount,
-                u.username,
-                b.created_at
-            FROM bills b
-            LEFT JOIN users u ON b.added_by = u.id
-            ORDER BY b.created_at DESC
-            LIMIT ?
+            ORDER BY time DESC
+            LIMIT :limit
         """,
-            (limit,),
+            {"limit": limit},
         ).fetchall()
 
-        for bill in bills:
+        logger.info(f"Total activities found: {len(rows)}")
+
+        currency = get_currency_symbol()
+        for row in rows:
+            template, icon, activity_type = ACTIVITY_FORMATS[
+                (row["kind"], bool(row["done"]))
+            ]
             activities.append(
                 {
-                    "description": f"{bill['username']} added bill: {bill['bill_name']} ({get_currency_symbol()}{bill['amount']})",
-                    "time": bill["created_at"],
-                    "icon": "fa-receipt",
-                    "type": "bill_added",
+                    "description": template.format(
+                        username=row["username"],
+                        name=row["name"],
+                        detail=row["detail"],
+                        currency=currency,
+                    ),
+                    "time": _format_activity_age(row["age_seconds"], row["time"]),
+                    "icon": icon,
+                    "type": activity_type,
                 }
             )
 
-        # Sort all activities by time (most recent first) and limit
-        activities.sort(key=lambda x: x["time"], reverse=True)
-        activities = activities[:limit]
-
-        logger.info(f"Total activities found: {len(activities)}")
-
-        # Format timestamps for display
-        from datetime import datetime
-
-        for activity in activities:
-            try:
-                # Parse the timestamp
-                dt = datetime.fromisoformat(activity["time"].replace("Z", "+00:00"))
-                # Format for display (e.g., "2 hours ago", "Yesterday", etc.)
-                now = datetime.now(tz=UTC)
-                diff = now - dt.replace(tzinfo=UTC)
-
-                if diff.days > 0:
-                    if diff.days == 1:
-                        activity["time"] = "Yesterday"
-                    else:
-                        activity["time"] = f"{diff.days} days ago"
-                elif diff.seconds > 3600:
-                    hours = diff.seconds // 3600
-                    activity["time"] = f"{hours} hour{'s' if hours > 1 else ''} ago"
-                elif diff.seconds > 60:
-                    minutes = diff.seconds // 60
-                    activity["time"] = (
-                        f"{minutes} minute{'s' if minutes > 1 else ''} ago"
-                    )
-                else:
-                    activity["time"] = "Just now"
-            except Exception as e:
-                # Fallback to original timestamp if parsing fails
-                logger.warning(f"Error parsing timestamp: {e}")
-                activity["time"] = activity["time"]
-
     except Exception as e:
         logger.error(f"Error getting recent activities: {e}")
 
-    finally:
-        conn.close()
-
     return activities
 
 
+def _format_activity_age(age_seconds, timestamp):
+    """Format an activity's age for display (e.g., "2 hours ago", "Yesterday", etc.)"""
+    if age_seconds is None:
+        # Fallback to original timestamp if SQLite could not parse it
+        logger.warning(f"Error parsing timestamp: {timestamp}")
+        return timestamp
+
+    days, seconds = divmod(age_seconds, 86400)
+    if days > 0:
+        if days == 1:
+            return "Yesterday"
+        return f"{days} days ago"
+    elif seconds > 3600:
+        hours = seconds // 3600
+        return f"{hours} hour{'s' if hours > 1 else ''} ago"
+    elif seconds > 60:
+        minutes = seconds // 60
+        return f"{minutes} minute{'s' if minutes > 1 else ''} ago"
+    return "Just now"
+
+
 def create_or_update_user(userinfo, access_control):
     """Create or update user from OIDC userinfo"""
     conn = get_db_connection()
@@ -467,103 +595,58 @@ def create_or_update_user(userinfo, access_control):
     full_name = userinfo.get("name", "")
     oidc_sub = userinfo.get("sub")
 
-    # Check if user is admin based on ADMIN_EMAILS
-    is_admin = email.lower() in [
-        admin_email.lower() for admin_email in access_control.get("admin_emails", [])
-    ]
+    # Check if user is admin based on ADMIN_EMAILS (already lowercased by load_access_control)
+    is_admin = email.lower() in access_control.get("admin_emails", frozenset())
 
     try:
-        # Try to find existing user by oidc_sub (primary identifier)
+        # Update existing user found by oidc_sub (primary identifier)
         user = conn.execute(
             """
-            SELECT * FROM users WHERE oidc_sub = ?
+            UPDATE users SET
+                username = ?, email = ?, full_name = ?,
+                is_admin = ?, last_login = CURRENT_TIMESTAMP
+            WHERE oidc_sub = ?
+            RETURNING *
         """,
-            (oidc_sub,),
+            (username, email, full_name, is_admin, oidc_sub),
         ).fetchone()
 
         if user:
-            # Update existing user
-            conn.execute(
-                """
-                UPDATE users SET
-                    username = ?, email = ?, full_name = ?,
-                    is_admin = ?, last_login = ?
-                WHERE oidc_sub = ?
-            """,
-                (
-                    username,
-                    email,
-                    full_name,
-                    is_admin,
-                    datetime.now().isoformat(),
-                    oidc_sub,
-                ),
-            )
             logger.info(f"Updated existing OIDC user: {email} (admin: {is_admin})")
         else:
-            # Check if a user with this email or username exists (from local auth or previous setup)
-            existing_user = conn.execute(
+            # Link a user with this email or username (from local auth or previous setup) to OIDC
+            user = conn.execute(
                 """
-                SELECT * FROM users WHERE email = ? OR username = ?
+                UPDATE users SET
+                    oidc_sub = ?, full_name = ?,
+                    is_admin = ?, last_login = CURRENT_TIMESTAMP
+                WHERE email = ? OR username = ?
+                RETURNING *
             """,
-                (email, username),
+                (oidc_sub, full_name, is_admin, email, username),
             ).fetchone()
 
-            if existing_user:
-                # Update the existing user to link with OIDC
+            if user:
                 logger.info(
-                    f"Linking existing user {email} to OIDC account (admin: {is_admin})"
-                )
-                conn.execute(
-                    """
-                    UPDATE users SET
-                        oidc_sub = ?, full_name = ?,
-                        is_admin = ?, last_login = ?
-                    WHERE email = ? OR username = ?
-                """,
-                    (
-                        oidc_sub,
-                        full_name,
-                        is_admin,
-                        datetime.now().isoformat(),
-                        email,
-                        username,
-                    ),
+                    f"Linked existing user {email} to OIDC account (admin: {is_admin})"
                 )
             else:
                 # Create new user
                 logger.info(f"Creating new OIDC user: {email} (admin: {is_admin})")
-                conn.execute(
+                user = conn.execute(
                     """
                     INSERT INTO users (username, email, full_name, is_admin, oidc_sub, last_login, created_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                    RETURNING *
                 """,
-                    (
-                        username,
-                        email,
-                        full_name,
-                        is_admin,
-                        oidc_sub,
-                        datetime.now().isoformat(),
-                        datetime.now().isoformat(),
-                    ),
-                )
+                    (username, email, full_name, is_admin, oidc_sub),
+                ).fetchone()
 
         conn.commit()
-
-        # Return the user record
-        user = conn.execute(
-            """
-            SELECT * FROM users WHERE oidc_sub = ?
-        """,
-            (oidc_sub,),
-        ).fetchone()
-
-        conn.close()
         return user
 
     except Exception as e:
-        conn.close()
+        conn.rollback()
         logger.error(f"Error creating/updating local user: {e}")
         raise
 
@@ -576,7 +659,6 @@ def get_all_users():
         FROM users
         ORDER BY username
     """).fetchall()
-    conn.close()
     return users
 
 
@@ -593,7 +675,6 @@ def get_user_feature_visibility(user_id, feature_name):
         (user_id, feature_name),
     ).fetchone()
 
-    conn.close()
 
     # If no specific setting exists, default to visible
     if visibility is None:
@@ -618,7 +699,6 @@ def get_all_user_features(user_id):
         (user_id,),
     ).fetchall()
 
-    conn.close()
 
     # Build a dict with all features (default to visible if not set)
     result = {feature: True for feature in all_features}
@@ -634,52 +714,22 @@ def set_user_feature_visibility(user_id, feature_name, is_visible, updated_by):
     conn = get_db_connection()
 
     try:
-        # Check if setting exists
-        existing = conn.execute(
+        # Create or update the setting in one statement
+        conn.execute(
             """
-            SELECT id FROM feature_visibility
-            WHERE user_id = ? AND feature_name = ?
+            INSERT INTO feature_visibility (user_id, feature_name, is_visible, updated_at, updated_by)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?)
+            ON CONFLICT (user_id, feature_name) DO UPDATE SET
+                is_visible = excluded.is_visible, updated_at = CURRENT_TIMESTAMP,
+                updated_by = excluded.updated_by
         """,
-            (user_id, feature_name),
-        ).fetchone()
-
-        if existing:
-            # Update existing setting
-            conn.execute(
-                """
-                UPDATE feature_visibility
-                SET is_visible = ?, updated_at = ?, updated_by = ?
-                WHERE user_id = ? AND feature_name = ?
-            """,
-                (
-                    is_visible,
-                    datetime.now().isoformat(),
-                    updated_by,
-                    user_id,
-                    feature_name,
-                ),
-            )
-        else:
-            # Create new setting
-            conn.execute(
-                """
-                INSERT INTO feature_visibility (user_id, feature_name, is_visible, updated_at, updated_by)
-                VALUES (?, ?, ?, ?, ?)
-            """,
-                (
-                    user_id,
-                    feature_name,
-                    is_visible,
-                    datetime.now().isoformat(),
-                    updated_by,
-                ),
-            )
+            (user_id, feature_name, is_visible, updated_by),
+        )
 
         conn.commit()
-        conn.close()
         return True
     except Exception as e:
-        conn.close()
+        conn.rollback()
         logger.error(f"Error setting feature visibility: {e}")
         return False
 
@@ -688,39 +738,40 @@ def get_all_users_features():
     """Get feature visibility settings for all users"""
     conn = get_db_connection()
 
-    # Get all users
-    users = conn.execute("""
-        SELECT id, username, email, full_name, is_admin
-        FROM users
-        ORDER BY username
+    # Get all users with their feature settings in one query (one row per setting)
+    rows = conn.execute("""
+        SELECT u.id, u.username, u.email, u.full_name, u.is_admin,
+               fv.feature_name, fv.is_visible
+        FROM users u
+        LEFT JOIN feature_visibility fv ON fv.user_id = u.id
+        ORDER BY u.username, u.id
     """).fetchall()
 
     # Define all available features
     all_features = ["shopping", "chores", "tracker", "bills", "budget"]
 
     result = []
-    for user in users:
-        user_dict = dict(user)
-
-        # Get this user's feature settings
-        settings = conn.execute(
-            """
-            SELECT feature_name, is_visible FROM feature_visibility
-            WHERE user_id = ?
-        """,
-            (user["id"],),
-        ).fetchall()
+    for user_id, user_rows in groupby(rows, key=itemgetter("id")):
+        user_rows = list(user_rows)
+        user = user_rows[0]
+        user_dict = {
+            "id": user_id,
+            "username": user["username"],
+            "email": user["email"],
+            "full_name": user["full_name"],
+            "is_admin": user["is_admin"],
+        }
 
         # Build features dict with defaults
         features = {feature: True for feature in all_features}
 
-        for setting in settings:
-            features[setting["feature_name"]] = bool(setting["is_visible"])
+        for setting in user_rows:
+            if setting["feature_name"] is not None:
+                features[setting["feature_name"]] = bool(setting["is_visible"])
 
         user_dict["features"] = features
         result.append(user_dict)
 
-    conn.close()
     return result
 
 
@@ -737,80 +788,38 @@ def create_or_update_local_user(user_info):
     is_admin = False  # Simplified: no admin distinction for local users
 
     try:
-        # Try to find existing user by username or email
+        # Update existing user found by username, email or pseudo oidc_sub
         user = conn.execute(
             """
-            SELECT * FROM users WHERE username = ? OR email = ? OR oidc_sub = ?
+            UPDATE users SET
+                username = ?, email = ?, full_name = ?,
+                is_admin = ?, last_login = CURRENT_TIMESTAMP, last_activity = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM users WHERE username = ? OR email = ? OR oidc_sub = ? LIMIT 1
+            )
+            RETURNING *
         """,
-            (username, email, oidc_sub),
+            (username, email, full_name, is_admin, username, email, oidc_sub),
         ).fetchone()
 
         if user:
-            # Update existing user
-            conn.execute(
-                """
-                UPDATE users SET
-                    username = ?, email = ?, full_name = ?,
-                    is_admin = ?, last_login = ?, last_activity = ?
-                WHERE id = ?
-            """,
-                (
-                    username,
-                    email,
-                    full_name,
-                    is_admin,
-                    datetime.now().isoformat(),
-                    datetime.now().isoformat(),
-                    user["id"],
-                ),
-            )
             logger.info(f"Updated local user: {username}")
         else:
             # Create new user
-            conn.execute(
+            user = conn.execute(
                 """
                 INSERT INTO users (username, email, full_name, is_admin, oidc_sub, last_login, created_at, last_activity)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                RETURNING *
             """,
-                (
-                    username,
-                    email,
-                    full_name,
-                    is_admin,
-                    oidc_sub,
-                    datetime.now().isoformat(),
-                    datetime.now().isoformat(),
-                    datetime.now().isoformat(),
-                ),
-            )
+                (username, email, full_name, is_admin, oidc_sub),
+            ).fetchone()
             logger.info(f"Created local user: {username}")
 
         conn.commit()
-
-        # Return the user record
-        user = conn.execute(
-            """
-            SELECT * FROM users WHERE oidc_sub = ?
-        """,
-            (oidc_sub,),
-        ).fetchone()
-
-        if not user:
-            logger.error(
-                f"User not found after creation/update with oidc_sub: {oidc_sub}"
-            )
-            # Try alternative query as fallback
-            user = conn.execute(
-                """
-                SELECT * FROM users WHERE username = ? AND email = ?
-            """,
-                (username, email),
-            ).fetchone()
-
-        conn.close()
         return user
 
     except Exception as e:
-        conn.close()
+        conn.rollback()
         logger.error(f"Error creating/updating local user: {e}")
         raise
@@ -0,0 +1,17 @@
+"""
+Gunicorn configuration for Homie
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# gevent workers keep serving other requests while one waits on the OIDC provider
+worker_class = 'gevent'
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+
+# Each worker imports the app after gevent has patched it; preloading in the master
+# would fork threads started at import time (e.g. the in-memory rate limit timer)
+preload_app = False
+
+accesslog = '-'
@@ -0,0 +1,41 @@
+"""
+JSON provider for Homie Flask application
+Serializes API responses with orjson when it is installed
+"""
+import logging
+from flask.json.provider import DefaultJSONProvider
+
+# Import orjson with fallback to Flask's standard library JSON provider
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, with Flask's fallbacks for other types"""
+
+    # Keyword arguments orjson can honour; anything else (e.g. cls, default) uses json
+    ORJSON_DUMPS_KWARGS = frozenset(('sort_keys', 'indent', 'separators'))
+
+    def dumps(self, obj, **kwargs):
+        """Serialize data as JSON text"""
+        if not kwargs.keys() <= self.ORJSON_DUMPS_KWARGS:
+            return super().dumps(obj, **kwargs)
+        
+        # Dates go through Flask's default so they keep the same HTTP date format
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        """Deserialize JSON text or bytes"""
+        # The session serializer passes an object_hook, which orjson does not support
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
@@ -32,7 +32,7 @@ def api_get_users():
     """API endpoint to get all users and their feature settings"""
     try:
         users_features = get_all_users_features()
-        return jsonify({'users': [dict(u) for u in users_features]})
+        return jsonify({'users': users_features})
     except Exception as e:
         logger.error(f"Error getting users: {e}")
         return jsonify({'error': 'Failed to get users'}), 500
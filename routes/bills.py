@@ -4,7 +4,7 @@ Bills routes for Homie Flask application
 from flask import Blueprint, render_template, request, redirect, url_for, jsonify, session, flash
 from authentication import login_required, api_auth_required, feature_required
 from database import get_db_connection
-from security import csrf_protect, validate_ownership, sanitize_input
+from security import csrf_protect, delete_owned_item, sanitize_input
 from datetime import datetime
 from utils.bills_utils import mark_bill_paid, get_budget_analytics, get_spending_history, process_recurring_bills
 import logging
@@ -13,6 +13,25 @@ logger = logging.getLogger(__name__)
 
 bills_bp = Blueprint('bills', __name__)
 
+# Paid bills accumulate every period, so that list is paginated
+PAID_BILLS_PAGE_SIZE = 50
+
+def get_monthly_total(conn, is_paid):
+    """Get the monthly estimate of paid or unpaid bills, computed by SQLite"""
+    # Weekly bills count 4 times, yearly bills 1/12; monthly and non-recurring bills count once
+    row = conn.execute('''
+        SELECT COALESCE(SUM(
+            CASE
+                WHEN is_recurring AND recurrence_pattern = 'weekly' THEN amount * 4
+                WHEN is_recurring AND recurrence_pattern = 'yearly' THEN amount / 12.0
+                ELSE amount
+            END
+        ), 0)
+        FROM bills
+        WHERE is_paid = ?
+    ''', (is_paid,)).fetchone()
+    return row[0]
+
 @bills_bp.route('/bills')
 @login_required
 @feature_required('bills')
@@ -39,31 +58,20 @@ def bills_list():
     categories = conn.execute('SELECT name FROM budget_categories ORDER BY name').fetchall()
     
     # Calculate monthly total based on recurrence patterns
-    monthly_total = 0
-    for bill in bills:
-        amount = bill['amount']
-        recurrence = bill['recurrence_pattern'] if bill['is_recurring'] else 'monthly'
-        
-        if recurrence == 'weekly':
-            # Weekly bills: multiply by 4 for monthly estimate
-            monthly_total += amount * 4
-        elif recurrence == 'yearly':
-            # Yearly bills: divide by 12 for monthly portion (excluded from monthly total)
-            monthly_total += amount / 12
-        else:  # monthly or non-recurring
-            monthly_total += amount
+    monthly_total = get_monthly_total(conn, is_paid=False)
     
-    conn.close()
     return render_template('bills.html', bills=bills, monthly_total=monthly_total, categories=categories, view='unpaid')
 
 @bills_bp.route('/bills/paid')
 @login_required
 @feature_required('bills')
 def paid_bills_list():
-    """Display all paid bills"""
+    """Display paid bills, one page at a time"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    
     conn = get_db_connection()
     
-    # Get all paid bills with paid_by user info
+    # Get a page of paid bills with paid_by user info (one extra row tells if there is a next page)
     bills = conn.execute('''
         SELECT b.*, 
                u1.username as added_by_name,
@@ -73,28 +81,21 @@ def paid_bills_list():
         LEFT JOIN users u2 ON b.paid_by = u2.id
         WHERE b.is_paid = TRUE
         ORDER BY b.paid_date DESC, b.created_at DESC
-    ''').fetchall()
+        LIMIT ? OFFSET ?
+    ''', (PAID_BILLS_PAGE_SIZE + 1, (page - 1) * PAID_BILLS_PAGE_SIZE)).fetchall()
+    
+    has_next = len(bills) > PAID_BILLS_PAGE_SIZE
+    bills = bills[:PAID_BILLS_PAGE_SIZE]
+    bill_count = conn.execute('SELECT COUNT(*) FROM bills WHERE is_paid = TRUE').fetchone()[0]
     
     # Get budget categories
     categories = conn.execute('SELECT name FROM budget_categories ORDER BY name').fetchall()
     
     # Calculate total paid based on recurrence patterns
-    monthly_total = 0
-    for bill in bills:
-        amount = bill['amount']
-        recurrence = bill['recurrence_pattern'] if bill['is_recurring'] else 'monthly'
-        
-        if recurrence == 'weekly':
-            # Weekly bills: multiply by 4 for monthly estimate
-            monthly_total += amount * 4
-        elif recurrence == 'yearly':
-            # Yearly bills: divide by 12 for monthly portion
-            monthly_total += amount / 12
-        else:  # monthly or non-recurring
-            monthly_total += amount
+    monthly_total = get_monthly_total(conn, is_paid=True)
     
-    conn.close()
-    return render_template('bills.html', bills=bills, monthly_total=monthly_total, categories=categories, view='paid')
+    return render_template('bills.html', bills=bills, monthly_total=monthly_total, categories=categories, view='paid',
+                           bill_count=bill_count, page=page, has_next=has_next)
 
 @bills_bp.route('/bills/budget')
 @login_required
@@ -105,7 +106,6 @@ def budget_dashboard():
     
     conn = get_db_connection()
     categories = conn.execute('SELECT * FROM budget_categories ORDER BY name').fetchall()
-    conn.close()
     
     return render_template('budget.html', analytics=analytics, categories=categories)
 
@@ -160,7 +160,6 @@ def add_bill():
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (bill_name, amount, due_day, category, is_recurring, recurrence_pattern, user_id))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} added bill: {bill_name}")
         flash('Bill added successfully', 'success')
@@ -205,22 +204,17 @@ def edit_bill():
         
         conn = get_db_connection()
         
-        # Check if bill exists
-        bill = conn.execute('SELECT * FROM bills WHERE id = ?', (bill_id,)).fetchone()
-        if not bill:
-            conn.close()
-            flash('Bill not found', 'error')
-            return redirect(url_for('bills.bills_list'))
-        
-        # Update the bill
-        conn.execute('''
+        # Update the bill; no affected row means it did not exist
+        result = conn.execute('''
             UPDATE bills 
             SET bill_name = ?, amount = ?, due_day = ?
             WHERE id = ?
         ''', (bill_name, amount, due_day, bill_id))
+        if result.rowcount == 0:
+            flash('Bill not found', 'error')
+            return redirect(url_for('bills.bills_list'))
         
         conn.commit()
-        conn.close()
         
         user_id = session['user']['id']
         logger.info(f"User {user_id} updated bill {bill_id}")
@@ -292,7 +286,6 @@ def add_bill_api():
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (bill_name, amount, due_day, category, is_recurring, recurrence_pattern, user_id))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} added bill: {bill_name}")
         return jsonify({'success': True, 'message': 'Bill added successfully'})
@@ -310,20 +303,14 @@ def delete_bill_api(bill_id):
     try:
         conn = get_db_connection()
         
-        # Validate ownership or admin rights
-        if not validate_ownership(conn, 'bills', bill_id, session['user']):
-            conn.close()
-            return jsonify({'error': 'Unauthorized'}), 403
-        
-        # Delete the bill
-        result = conn.execute('DELETE FROM bills WHERE id = ?', (bill_id,))
-        
-        if result.rowcount == 0:
-            conn.close()
+        # Delete the bill if the user owns it (admins can delete any bill)
+        if not delete_owned_item(conn, 'bills', bill_id, session['user']):
+            # Non-admins get the same answer for missing and other users' bills
+            if not session['user'].get('is_admin', False):
+                return jsonify({'error': 'Unauthorized'}), 403
             return jsonify({'error': 'Bill not found'}), 404
         
         conn.commit()
-        conn.close()
         
         user_id = session['user']['id']
         logger.info(f"User {user_id} deleted bill {bill_id}")
@@ -342,7 +329,6 @@ def get_budget_categories():
     try:
         conn = get_db_connection()
         categories = conn.execute('SELECT * FROM budget_categories ORDER BY name').fetchall()
-        conn.close()
         
         return jsonify({'categories': [dict(cat) for cat in categories]})
         
@@ -376,11 +362,9 @@ def update_budget_category(category_id):
         ''', (monthly_limit, category_id))
         
         if result.rowcount == 0:
-            conn.close()
             return jsonify({'error': 'Category not found'}), 404
         
         conn.commit()
-        conn.close()
         
         logger.info(f"User {session['user']['id']} updated budget category {category_id}")
         return jsonify({'success': True, 'message': 'Category updated successfully'})
@@ -412,7 +396,6 @@ def add_category():
         # Check if category already exists
         existing = conn.execute('SELECT id FROM budget_categories WHERE name = ?', (name,)).fetchone()
         if existing:
-            conn.close()
             return jsonify({'error': 'Category already exists'}), 400
         
         conn.execute('''
@@ -421,7 +404,6 @@ def add_category():
         ''', (name, monthly_limit))
         
         conn.commit()
-        conn.close()
         
         logger.info(f"User {session['user']['id']} added category: {name}")
         return jsonify({'success': True, 'message': 'Category added successfully'})
@@ -453,23 +435,20 @@ def update_category(category_id):
             (name, category_id)
         ).fetchone()
         if existing:
-            conn.close()
             return jsonify({'error': 'Category name already exists'}), 400
         
         # Get old name for updating bills
         old_category = conn.execute('SELECT name FROM budget_categories WHERE id = ?', (category_id,)).fetchone()
         if not old_category:
-            conn.close()
             return jsonify({'error': 'Category not found'}), 404
         
-        # Update category name
-        conn.execute('UPDATE budget_categories SET name = ? WHERE id = ?', (name, category_id))
-        
-        # Update all bills with this category
-        conn.execute('UPDATE bills SET category = ? WHERE category = ?', (name, old_category['name']))
-        
-        conn.commit()
-        conn.close()
+        # Rename the category and its bills together (rolled back on error)
+        with conn:
+            # Update category name
+            conn.execute('UPDATE budget_categories SET name = ? WHERE id = ?', (name, category_id))
+            
+            # Update all bills with this category
+            conn.execute('UPDATE bills SET category = ? WHERE category = ?', (name, old_category['name']))
         
         logger.info(f"User {session['user']['id']} edited category {category_id} to: {name}")
         return jsonify({'success': True, 'message': 'Category updated successfully'})
@@ -491,17 +470,14 @@ def delete_category(category_id):
         bills_using = conn.execute('SELECT COUNT(*) as count FROM bills WHERE category = (SELECT name FROM budget_categories WHERE id = ?)', (category_id,)).fetchone()
         
         if bills_using['count'] > 0:
-            conn.close()
             return jsonify({'error': f'Cannot delete category. {bills_using["count"]} bill(s) are using it.'}), 400
         
         result = conn.execute('DELETE FROM budget_categories WHERE id = ?', (category_id,))
         
         if result.rowcount == 0:
-            conn.close()
             return jsonify({'error': 'Category not found'}), 404
         
         conn.commit()
-        conn.close()
         
         logger.info(f"User {session['user']['id']} deleted category {category_id}")
         return jsonify({'success': True, 'message': 'Category deleted successfully'})
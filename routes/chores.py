@@ -4,7 +4,7 @@ Chores routes for Homie Flask application
 from flask import Blueprint, render_template, request, redirect, url_for, jsonify, session, flash
 from authentication import login_required, api_auth_required, feature_required
 from database import get_db_connection
-from security import csrf_protect, validate_ownership, sanitize_input
+from security import csrf_protect, delete_owned_item, sanitize_input
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,9 +18,9 @@ def chores_list():
     """Display the chores page"""
     conn = get_db_connection()
     
-    # Get all chores with user information
+    # Get all chores with user information (only the columns the template shows)
     all_chores = conn.execute('''
-        SELECT c.*, 
+        SELECT c.id, c.chore_name, c.assigned_to, c.completed, c.created_at, c.completed_at,
                au.username as added_by_username,
                asu.username as assigned_to_username,
                cu.username as completed_by_username
@@ -31,14 +31,14 @@ def chores_list():
         ORDER BY c.completed ASC, c.created_at DESC
     ''').fetchall()
     
-    # Split chores into pending and completed
-    pending_chores = [chore for chore in all_chores if not chore['completed']]
-    completed_chores = [chore for chore in all_chores if chore['completed']]
+    # Split chores into pending and completed in a single pass
+    pending_chores, completed_chores = [], []
+    for chore in all_chores:
+        (completed_chores if chore['completed'] else pending_chores).append(chore)
     
     # Get all users for assignment dropdown
     users = conn.execute('SELECT id, username FROM users ORDER BY username').fetchall()
     
-    conn.close()
     return render_template('chores.html', 
                          pending_chores=pending_chores, 
                          completed_chores=completed_chores, 
@@ -73,7 +73,6 @@ def add_chore():
         if assigned_to is not None:
             user_exists = conn.execute('SELECT id FROM users WHERE id = ?', (assigned_to,)).fetchone()
             if not user_exists:
-                conn.close()
                 flash('Assigned user does not exist', 'error')
                 return redirect(url_for('chores.chores_list'))
         
@@ -82,7 +81,6 @@ def add_chore():
             VALUES (?, ?, ?)
         ''', (chore_name, assigned_to, user_id))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} added chore: {chore_name}")
         flash('Chore added successfully', 'success')
@@ -125,7 +123,6 @@ def add_chore_api():
         if assigned_to is not None:
             user_exists = conn.execute('SELECT id FROM users WHERE id = ?', (assigned_to,)).fetchone()
             if not user_exists:
-                conn.close()
                 return jsonify({'error': 'Assigned user does not exist'}), 400
         
         conn.execute('''
@@ -133,7 +130,6 @@ def add_chore_api():
             VALUES (?, ?, ?)
         ''', (chore_name, assigned_to, user_id))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} added chore: {chore_name}")
         return jsonify({'success': True, 'message': 'Chore added successfully'})
@@ -163,20 +159,16 @@ def complete_chore():
         
         conn = get_db_connection()
         
-        # Check if chore exists and user has permission
-        chore = conn.execute('SELECT * FROM chores WHERE id = ?', (chore_id,)).fetchone()
-        if not chore:
-            conn.close()
-            flash('Chore not found', 'error')
-            return redirect(url_for('chores.chores_list'))
-        
-        # Update chore as completed
-        conn.execute('''
+        # Update chore as completed; no affected row means it did not exist
+        result = conn.execute('''
             UPDATE chores SET completed = 1, completed_by = ?, completed_at = CURRENT_TIMESTAMP
             WHERE id = ?
         ''', (user_id, chore_id))
+        if result.rowcount == 0:
+            flash('Chore not found', 'error')
+            return redirect(url_for('chores.chores_list'))
+        
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} completed chore {chore_id}")
         flash('Chore marked as completed', 'success')
@@ -208,17 +200,13 @@ def delete_chore():
         
         conn = get_db_connection()
         
-        # Check if chore exists
-        chore = conn.execute('SELECT * FROM chores WHERE id = ?', (chore_id,)).fetchone()
-        if not chore:
-            conn.close()
+        # Delete the chore; no affected row means it did not exist
+        result = conn.execute('DELETE FROM chores WHERE id = ?', (chore_id,))
+        if result.rowcount == 0:
             flash('Chore not found', 'error')
             return redirect(url_for('chores.chores_list'))
         
-        # Delete the chore
-        conn.execute('DELETE FROM chores WHERE id = ?', (chore_id,))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} deleted chore {chore_id}")
         flash('Chore deleted successfully', 'success')
@@ -237,34 +225,22 @@ def toggle_chore(chore_id):
     """Toggle completion status of a chore"""
     try:
         conn = get_db_connection()
-        
-        # Get the current chore
-        chore = conn.execute('SELECT * FROM chores WHERE id = ?', (chore_id,)).fetchone()
-        if not chore:
-            conn.close()
-            return jsonify({'error': 'Chore not found'}), 404
-        
         user_id = session['user']['id']
         
-        # Toggle the completion status
-        new_status = not chore['completed']
-        completed_by = user_id if new_status else None
-        
-        if new_status:
-            conn.execute('''
-                UPDATE chores 
-                SET completed = ?, completed_by = ?, completed_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (new_status, completed_by, chore_id))
-        else:
-            conn.execute('''
-                UPDATE chores 
-                SET completed = ?, completed_by = NULL, completed_at = NULL
-                WHERE id = ?
-            ''', (new_status, chore_id))
+        # Flip the completion status in one statement; SET expressions see the old row
+        row = conn.execute('''
+            UPDATE chores
+            SET completed = NOT COALESCE(completed, 0),
+                completed_by = CASE WHEN COALESCE(completed, 0) THEN NULL ELSE ? END,
+                completed_at = CASE WHEN COALESCE(completed, 0) THEN NULL ELSE CURRENT_TIMESTAMP END
+            WHERE id = ?
+            RETURNING completed
+        ''', (user_id, chore_id)).fetchone()
+        if not row:
+            return jsonify({'error': 'Chore not found'}), 404
         
         conn.commit()
-        conn.close()
+        new_status = bool(row['completed'])
         
         action = "completed" if new_status else "uncompleted"
         logger.info(f"User {user_id} {action} chore {chore_id}")
@@ -284,20 +260,14 @@ def delete_chore_api(chore_id):
     try:
         conn = get_db_connection()
         
-        # Validate ownership or admin rights
-        if not validate_ownership(conn, 'chores', chore_id, session['user']):
-            conn.close()
-            return jsonify({'error': 'Unauthorized'}), 403
-        
-        # Delete the chore
-        result = conn.execute('DELETE FROM chores WHERE id = ?', (chore_id,))
-        
-        if result.rowcount == 0:
-            conn.close()
+        # Delete the chore if the user owns it (admins can delete any chore)
+        if not delete_owned_item(conn, 'chores', chore_id, session['user']):
+            # Non-admins get the same answer for missing and other users' chores
+            if not session['user'].get('is_admin', False):
+                return jsonify({'error': 'Unauthorized'}), 403
             return jsonify({'error': 'Chore not found'}), 404
         
         conn.commit()
-        conn.close()
         
         user_id = session['user']['id']
         logger.info(f"User {user_id} deleted chore {chore_id}")
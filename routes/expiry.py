@@ -4,7 +4,7 @@ Expiry tracker routes for Homie Flask application
 from flask import Blueprint, render_template, request, redirect, url_for, jsonify, session, flash
 from authentication import login_required, api_auth_required, feature_required
 from database import get_db_connection
-from security import csrf_protect, validate_ownership, sanitize_input
+from security import csrf_protect, delete_owned_item, sanitize_input
 from datetime import datetime, date, timedelta
 import logging
 
@@ -34,8 +34,17 @@ def expiry_list():
         ORDER BY e.expiry_date ASC
     ''').fetchall()
     
-    conn.close()
-    return render_template('expiry_tracker.html', items=items)
+    # Quick stats from the rows already fetched, classified the same way as the row icons in the template
+    expired_count = expiring_soon_count = 0
+    for item in items:
+        if item['days_remaining'] < 0:
+            expired_count += 1
+        elif item['days_remaining'] <= 30:
+            expiring_soon_count += 1
+    
+    return render_template('expiry_tracker.html', items=items,
+                           expired_count=expired_count,
+                           expiring_soon_count=expiring_soon_count)
 
 @expiry_bp.route('/expiry/add', methods=['POST'])
 @login_required
@@ -52,7 +61,6 @@ def add_expiry():
         
         # Validate date format
         try:
-            from datetime import datetime
             datetime.strptime(expiry_date, '%Y-%m-%d')
         except ValueError:
             flash('Invalid date format. Please use YYYY-MM-DD', 'error')
@@ -66,7 +74,6 @@ def add_expiry():
             VALUES (?, ?, ?)
         ''', (item_name, expiry_date, user_id))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} added expiry item: {item_name} expires on {expiry_date}")
         flash('Expiry item added successfully', 'success')
@@ -111,7 +118,6 @@ def add_expiry_item_api():
             VALUES (?, ?, ?)
         ''', (item_name, expiry_date.isoformat(), user_id))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} added expiry item: {item_name} - {expiry_date}")
         return jsonify({'success': True, 'message': 'Expiry item added successfully'})
@@ -141,17 +147,13 @@ def delete_expiry():
         
         conn = get_db_connection()
         
-        # Check if item exists and user has permission
-        item = conn.execute('SELECT * FROM expiry_items WHERE id = ?', (item_id,)).fetchone()
-        if not item:
-            conn.close()
+        # Delete the item; no affected row means it did not exist
+        result = conn.execute('DELETE FROM expiry_items WHERE id = ?', (item_id,))
+        if result.rowcount == 0:
             flash('Item not found', 'error')
             return redirect(url_for('expiry.expiry_list'))
         
-        # Delete the item
-        conn.execute('DELETE FROM expiry_items WHERE id = ?', (item_id,))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} deleted expiry item {item_id}")
         flash('Expiry item deleted successfully', 'success')
@@ -171,20 +173,14 @@ def delete_expiry_item_api(item_id):
     try:
         conn = get_db_connection()
         
-        # Validate ownership or admin rights
-        if not validate_ownership(conn, 'expiry_items', item_id, session['user']):
-            conn.close()
-            return jsonify({'error': 'Unauthorized'}), 403
-        
-        # Delete the item
-        result = conn.execute('DELETE FROM expiry_items WHERE id = ?', (item_id,))
-        
-        if result.rowcount == 0:
-            conn.close()
+        # Delete the item if the user owns it (admins can delete any item)
+        if not delete_owned_item(conn, 'expiry_items', item_id, session['user']):
+            # Non-admins get the same answer for missing and other users' items
+            if not session['user'].get('is_admin', False):
+                return jsonify({'error': 'Unauthorized'}), 403
             return jsonify({'error': 'Expiry item not found'}), 404
         
         conn.commit()
-        conn.close()
         
         user_id = session['user']['id']
         logger.info(f"User {user_id} deleted expiry item {item_id}")
@@ -4,7 +4,7 @@ Shopping list routes for Homie Flask application
 from flask import Blueprint, render_template, request, redirect, url_for, jsonify, session, flash
 from authentication import login_required, api_auth_required, feature_required
 from database import get_db_connection
-from security import csrf_protect, validate_ownership, sanitize_input
+from security import csrf_protect, delete_owned_item, sanitize_input
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,16 +18,16 @@ def shopping_list():
     """Display the shopping list page"""
     conn = get_db_connection()
     
-    # Get all shopping items with user information
+    # Get all shopping items with user information (only the columns the template shows)
     items = conn.execute('''
-        SELECT si.*, u.username as added_by_username, cu.username as completed_by_username
+        SELECT si.id, si.item_name, si.completed, si.created_at, si.completed_at,
+               u.username as added_by_username, cu.username as completed_by_username
         FROM shopping_items si
         LEFT JOIN users u ON si.added_by = u.id
         LEFT JOIN users cu ON si.completed_by = cu.id
         ORDER BY si.completed ASC, si.created_at DESC
     ''').fetchall()
     
-    conn.close()
     return render_template('shopping_list.html', items=items)
 
 @shopping_bp.route('/shopping/add', methods=['POST'])
@@ -53,7 +53,6 @@ def add_shopping_item():
             VALUES (?, ?)
         ''', (item_name, user_id))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} added shopping item: {item_name}")
         flash('Item added successfully', 'success')
@@ -87,7 +86,6 @@ def add_shopping_item_api():
             VALUES (?, ?)
         ''', (item_name, user_id))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} added shopping item: {item_name}")
         return jsonify({'success': True, 'message': 'Item added successfully'})
@@ -104,35 +102,22 @@ def toggle_shopping_item(item_id):
     """Toggle completion status of a shopping item"""
     try:
         conn = get_db_connection()
-        
-        # Get the current item
-        item = conn.execute('SELECT * FROM shopping_items WHERE id = ?', (item_id,)).fetchone()
-        if not item:
-            conn.close()
-            return jsonify({'error': 'Item not found'}), 404
-        
         user_id = session['user']['id']
         
-        # Toggle the completion status
-        new_status = not item['completed']
-        completed_by = user_id if new_status else None
-        completed_at = 'CURRENT_TIMESTAMP' if new_status else None
-        
-        if new_status:
-            conn.execute('''
-                UPDATE shopping_items 
-                SET completed = ?, completed_by = ?, completed_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (new_status, completed_by, item_id))
-        else:
-            conn.execute('''
-                UPDATE shopping_items 
-                SET completed = ?, completed_by = NULL, completed_at = NULL
-                WHERE id = ?
-            ''', (new_status, item_id))
+        # Flip the completion status in one statement; SET expressions see the old row
+        row = conn.execute('''
+            UPDATE shopping_items
+            SET completed = NOT COALESCE(completed, 0),
+                completed_by = CASE WHEN COALESCE(completed, 0) THEN NULL ELSE ? END,
+                completed_at = CASE WHEN COALESCE(completed, 0) THEN NULL ELSE CURRENT_TIMESTAMP END
+            WHERE id = ?
+            RETURNING completed
+        ''', (user_id, item_id)).fetchone()
+        if not row:
+            return jsonify({'error': 'Item not found'}), 404
         
         conn.commit()
-        conn.close()
+        new_status = bool(row['completed'])
         
         action = "completed" if new_status else "uncompleted"
         logger.info(f"User {user_id} {action} shopping item {item_id}")
@@ -164,17 +149,13 @@ def delete_shopping_item():
         
         conn = get_db_connection()
         
-        # Check if item exists and user has permission
-        item = conn.execute('SELECT * FROM shopping_items WHERE id = ?', (item_id,)).fetchone()
-        if not item:
-            conn.close()
+        # Delete the item; no affected row means it did not exist
+        result = conn.execute('DELETE FROM shopping_items WHERE id = ?', (item_id,))
+        if result.rowcount == 0:
             flash('Item not found', 'error')
             return redirect(url_for('shopping.shopping_list'))
         
-        # Delete the item
-        conn.execute('DELETE FROM shopping_items WHERE id = ?', (item_id,))
         conn.commit()
-        conn.close()
         
         logger.info(f"User {user_id} deleted shopping item {item_id}")
         flash('Shopping item deleted successfully', 'success')
@@ -206,32 +187,21 @@ def toggle_shopping_item_form():
         
         conn = get_db_connection()
         
-        # Get current status
-        item = conn.execute('SELECT * FROM shopping_items WHERE id = ?', (item_id,)).fetchone()
-        if not item:
-            conn.close()
+        # Flip the completion status in one statement; SET expressions see the old row
+        row = conn.execute('''
+            UPDATE shopping_items
+            SET completed = NOT COALESCE(completed, 0),
+                completed_by = CASE WHEN COALESCE(completed, 0) THEN NULL ELSE ? END,
+                completed_at = CASE WHEN COALESCE(completed, 0) THEN NULL ELSE CURRENT_TIMESTAMP END
+            WHERE id = ?
+            RETURNING completed
+        ''', (user_id, item_id)).fetchone()
+        if not row:
             flash('Item not found', 'error')
             return redirect(url_for('shopping.shopping_list'))
         
-        # Toggle completion status
-        new_status = not item['completed']
-        completed_by = user_id if new_status else None
-        
-        if new_status:
-            conn.execute('''
-                UPDATE shopping_items 
-                SET completed = ?, completed_by = ?, completed_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (new_status, completed_by, item_id))
-        else:
-            conn.execute('''
-                UPDATE shopping_items 
-                SET completed = ?, completed_by = NULL, completed_at = NULL
-                WHERE id = ?
-            ''', (new_status, item_id))
-        
         conn.commit()
-        conn.close()
+        new_status = bool(row['completed'])
         
         action = "completed" if new_status else "uncompleted"
         logger.info(f"User {user_id} {action} shopping item {item_id}")
@@ -252,20 +222,14 @@ def delete_shopping_item_api(item_id):
     try:
         conn = get_db_connection()
         
-        # Validate ownership or admin rights
-        if not validate_ownership(conn, 'shopping_items', item_id, session['user']):
-            conn.close()
-            return jsonify({'error': 'Unauthorized'}), 403
-        
-        # Delete the item
-        result = conn.execute('DELETE FROM shopping_items WHERE id = ?', (item_id,))
-        
-        if result.rowcount == 0:
-            conn.close()
+        # Delete the item if the user owns it (admins can delete any item)
+        if not delete_owned_item(conn, 'shopping_items', item_id, session['user']):
+            # Non-admins get the same answer for missing and other users' items
+            if not session['user'].get('is_admin', False):
+                return jsonify({'error': 'Unauthorized'}), 403
             return jsonify({'error': 'Item not found'}), 404
         
         conn.commit()
-        conn.close()
         
         user_id = session['user']['id']
         logger.info(f"User {user_id} deleted shopping item {item_id}")
@@ -2,10 +2,11 @@
 Security utilities for Homie Flask application
 Handles CSRF protection, input validation, and other security measures
 """
+import html
 import secrets
 import logging
 from functools import wraps
-from flask import session, request, jsonify, abort, current_app
+from flask import session, request, jsonify, abort, current_app, g
 from urllib.parse import urlparse
 
 # Import bleach with fallback for local development
@@ -16,15 +17,17 @@ except ImportError:
     BLEACH_AVAILABLE = False
     logging.warning("bleach not available - HTML sanitization will use basic escaping")
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def generate_csrf_token():
-    """Generate a CSRF token for the session"""
-    if '_csrf_token' not in session:
-        session['_csrf_token'] = secrets.token_urlsafe(32)
-    return session['_csrf_token']
+    """Generate a CSRF token for the session (memoized for the current request)"""
+    token = g.get('_csrf_token')
+    if token is None:
+        token = session.get('_csrf_token')
+        if token is None:
+            token = session['_csrf_token'] = secrets.token_urlsafe(32)
+        g._csrf_token = token
+    return token
 
 def validate_csrf_token(token):
     """Validate CSRF token against session token"""
@@ -64,7 +67,6 @@ def sanitize_html_input(text):
         return bleach.clean(text, tags=allowed_tags, strip=True)
     else:
         # Fallback: escape HTML entities
-        import html
         return html.escape(text)
 
 def sanitize_input(text):
@@ -78,7 +80,6 @@ def sanitize_input(text):
         return ' '.join(clean_text.split())
     else:
         # Fallback: basic cleaning without HTML stripping
-        import html
         escaped = html.escape(text)
         return ' '.join(escaped.split())
 
@@ -107,6 +108,16 @@ def safe_delete_item(conn, table, item_id, user_id, id_column='id', user_column=
     result = conn.execute(query, (item_id, user_id))
     return result.rowcount > 0
 
+def delete_owned_item(conn, table, item_id, user, id_column='id', user_column='added_by'):
+    """Delete an item the user owns (admins can delete any item) in a single statement"""
+    if user.get('is_admin', False):
+        query = f"DELETE FROM {table} WHERE {id_column} = ?"
+        result = conn.execute(query, (item_id,))
+    else:
+        query = f"DELETE FROM {table} WHERE {id_column} = ? AND {user_column} = ?"
+        result = conn.execute(query, (item_id, user['id']))
+    return result.rowcount > 0
+
 def validate_ownership(conn, table, item_id, user):
     """Validate that user owns item or is admin"""
     # Admins can access anything
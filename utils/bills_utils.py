@@ -3,9 +3,9 @@ Utility functions for bills management
 Handles recurring bills and budget tracking
 """
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from database import get_db_connection
+from database import get_db_connection, mark_data_changed
 
 logger = logging.getLogger(__name__)
 
@@ -17,35 +17,54 @@ def process_recurring_bills():
     conn = get_db_connection()
     
     try:
-        # Get all recurring bills that are paid and need renewal
+        # Get paid recurring bills whose next period is close and has no unpaid bill yet.
+        # SQLite's month/year arithmetic overflows short months (Jan 31 + 1 month = Mar 3),
+        # so the window is 3 days wider here and should_create_next_bill() has the final say.
         bills = conn.execute('''
-            SELECT * FROM bills 
-            WHERE is_recurring = TRUE 
-            AND is_paid = TRUE
-            AND paid_date IS NOT NULL
+            SELECT * FROM bills b
+            WHERE b.is_recurring = TRUE 
+            AND b.is_paid = TRUE
+            AND b.paid_date IS NOT NULL
+            AND date(b.paid_date, CASE b.recurrence_pattern
+                                      WHEN 'weekly' THEN '+7 days'
+                                      WHEN 'monthly' THEN '+1 month'
+                                      WHEN 'yearly' THEN '+1 year'
+                                  END) <= date('now', '+8 days')
+            AND NOT EXISTS (
+                SELECT 1 FROM bills n
+                WHERE n.bill_name = b.bill_name
+                AND n.added_by = b.added_by
+                AND n.is_paid = FALSE
+                AND n.category = b.category
+            )
         ''').fetchall()
         
-        for bill in bills:
-            # Check if we need to create next period's bill
-            if should_create_next_bill(bill):
-                create_next_recurring_bill(conn, bill)
+        # Create all due next-period bills in one transaction (rolled back on error)
+        created = 0
+        with conn:
+            for bill in bills:
+                # Check if we need to create next period's bill
+                if should_create_next_bill(bill):
+                    create_next_recurring_bill(conn, bill)
+                    created += 1
+        
+        # This runs during GET /bills, which does not invalidate the dashboard cache itself
+        if created:
+            mark_data_changed()
         
-        conn.commit()
         logger.info(f"Processed {len(bills)} recurring bills")
         
     except Exception as e:
         logger.error(f"Error processing recurring bills: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
 
 def should_create_next_bill(bill):
     """Check if next bill period should be created"""
     if not bill['paid_date']:
         return False
     
-    paid_date = datetime.strptime(bill['paid_date'], '%Y-%m-%d').date()
-    today = datetime.now().date()
+    # paid_date is stored as YYYY-MM-DD, which date.fromisoformat parses without strptime's format machinery
+    paid_date = date.fromisoformat(bill['paid_date'])
+    today = date.today()
     pattern = bill['recurrence_pattern']
     
     if pattern == 'monthly':
@@ -112,35 +131,37 @@ def mark_bill_paid(bill_id, user_id, payment_date=None):
         if not bill:
             return False
         
-        # Mark bill as paid
-        conn.execute('''
-            UPDATE bills 
-            SET is_paid = TRUE, paid_date = ?, paid_by = ?
-            WHERE id = ?
-        ''', (payment_date, user_id, bill_id))
-        
-        # Record payment in history
-        conn.execute('''
-            INSERT INTO bill_payments (bill_id, amount, payment_date, paid_by)
-            VALUES (?, ?, ?, ?)
-        ''', (bill_id, bill['amount'], payment_date, user_id))
-        
-        conn.commit()
-        
-        # If recurring, check if we should create next bill immediately
-        if bill['is_recurring'] and should_create_next_bill(bill):
-            create_next_recurring_bill(conn, bill)
-            conn.commit()
+        # Payment, history and next period's bill commit together (rolled back on error)
+        with conn:
+            # Mark bill as paid
+            conn.execute('''
+                UPDATE bills 
+                SET is_paid = TRUE, paid_date = ?, paid_by = ?
+                WHERE id = ?
+            ''', (payment_date, user_id, bill_id))
+            
+            # Record payment in history
+            conn.execute('''
+                INSERT INTO bill_payments (bill_id, amount, payment_date, paid_by)
+                VALUES (?, ?, ?, ?)
+            ''', (bill_id, bill['amount'], payment_date, user_id))
+            
+            # If recurring, check if we should create next bill immediately
+            if bill['is_recurring'] and should_create_next_bill(bill):
+                create_next_recurring_bill(conn, bill)
         
         logger.info(f"Bill {bill_id} marked as paid by user {user_id}")
         return True
         
     except Exception as e:
         logger.error(f"Error marking bill as paid: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
+
+def get_month_range(year, month):
+    """Get the [start, end) paid_date bounds for a month, so queries can use the paid_date index"""
+    start = datetime(year, month, 1)
+    end = start + relativedelta(months=1)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
 
 def get_budget_analytics(year=None, month=None):
     """Get budget analytics for specified period including recurring bills"""
@@ -160,10 +181,9 @@ def get_budget_analytics(year=None, month=None):
                 COUNT(*) as bill_count
             FROM bills
             WHERE is_paid = TRUE
-            AND strftime('%Y', paid_date) = ?
-            AND strftime('%m', paid_date) = ?
+            AND paid_date >= ? AND paid_date < ?
             GROUP BY category
-        ''', (str(year), f"{month:02d}")).fetchall()
+        ''', get_month_range(year, month)).fetchall()
         
         # Get unpaid recurring bills (convert to monthly equivalent)
         recurring_bills = conn.execute('''
@@ -235,8 +255,6 @@ def get_budget_analytics(year=None, month=None):
     except Exception as e:
         logger.error(f"Error getting budget analytics: {e}")
         return None
-    finally:
-        conn.close()
 
 def get_spending_history(months=6):
     """Get spending history for the last N months including recurring bills"""
@@ -274,9 +292,8 @@ def get_spending_history(months=6):
                 SELECT SUM(amount) as total
                 FROM bills
                 WHERE is_paid = TRUE
-                AND strftime('%Y', paid_date) = ?
-                AND strftime('%m', paid_date) = ?
-            ''', (str(year), f"{month:02d}")).fetchone()
+                AND paid_date >= ? AND paid_date < ?
+            ''', get_month_range(year, month)).fetchone()
             
             # Combine paid bills + recurring monthly equivalent
             total = float(paid_total['total'] or 0) + recurring_monthly_total
@@ -291,5 +308,3 @@ def get_spending_history(months=6):
     except Exception as e:
         logger.error(f"Error getting spending history: {e}")
         return []
-    finally:
-        conn.close()
@@ -0,0 +1,10 @@
+"""
+Homie - Family Utility App
+WSGI entry point for running under gunicorn with gevent workers
+"""
+from gevent import monkey
+
+# Patch sockets/ssl before requests is imported so OIDC calls yield to other requests
+monkey.patch_all()
+
+from app import app  # noqa: E402